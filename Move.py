@@ -3,166 +3,290 @@ from geometry_msgs.msg import Twist
 import math
 import os
 import time
+import threading
+from collections import namedtuple
 from nav_msgs.msg import Odometry
 import tf
-import math
-
-def get_yaw_once(log = False):
-    rospy.init_node('turtlebot_turn_90', anonymous=True)
-    msg = rospy.wait_for_message("/odom", Odometry)
-
-    orientation_q = msg.pose.pose.orientation
-    quaternion = (
-        orientation_q.x,
-        orientation_q.y,
-        orientation_q.z,
-        orientation_q.w
-    )
-    (roll, pitch, yaw) = tf.transformations.euler_from_quaternion(quaternion)
-    yaw_degrees = math.degrees(yaw)
-
-    if(log):
-        rospy.loginfo("Bearing (Yaw): {:.2f} degrees".format(yaw_degrees))
-    return yaw
-
-def move_backwards():
-    rospy.init_node('turtlebot_backwards', anonymous=True)
-    pub = rospy.Publisher('/mobile_base/commands/velocity', Twist, queue_size=10)
-    rate = rospy.Rate(10)  # 10 Hz
+from tracing import span, event
+
+Pose = namedtuple("Pose", ["x", "y", "yaw", "stamp"])
+HeadingResult = namedtuple("HeadingResult", ["error", "elapsed", "settled"])
+MoveResult = namedtuple("MoveResult", ["error", "elapsed", "reached"])
+
+# Survey grid, matched to what the old single-Twist moves travelled before the base's
+# 0.6 s command timeout stopped them (0.125 m/s per sample step, 0.5 m/s per row change)
+STEP_DISTANCE = 0.075  # m between samples along a row
+ROW_SPACING = 0.3      # m between rows
+
+def wrap_angle(angle):
+    # Into [-pi, pi) so targets across the +/-pi seam are reached the short way round
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+class HeadingController:
+    # PID on the wrapped heading error with angular velocity and acceleration limits
+
+    def __init__(self, kp=1.8, ki=0.2, kd=0.08, max_rate=0.8, max_accel=2.0, min_rate=0.05,
+                 tolerance=0.015, settle_time=0.25, rate_hz=40, timeout=15.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.max_rate = max_rate      # rad/s
+        self.max_accel = max_accel    # rad/s^2
+        self.min_rate = min_rate      # smallest command that still turns the base
+        self.tolerance = tolerance    # rad
+        self.settle_time = settle_time
+        self.rate_hz = rate_hz
+        self.timeout = timeout
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.prev_error = None
+        self.command = 0.0
+
+    def update(self, error, dt):
+        if abs(error) <= self.tolerance:
+            # Inside the band: hold still rather than dither, and drop the integral
+            target = 0.0
+            self.integral = 0.0
+        else:
+            self.integral += error * dt
+            if self.ki:
+                limit = self.max_rate / self.ki
+                self.integral = max(-limit, min(limit, self.integral))
+            derivative = 0.0 if self.prev_error is None else wrap_angle(error - self.prev_error) / dt
+            target = self.kp * error + self.ki * self.integral + self.kd * derivative
+            target = max(-self.max_rate, min(self.max_rate, target))
+            if abs(target) < self.min_rate:
+                target = math.copysign(self.min_rate, error)
+        self.prev_error = error
+
+        max_step = self.max_accel * dt
+        self.command += max(-max_step, min(max_step, target - self.command))
+        return self.command
+
+class MotionController:
+    # One ROS node and velocity publisher for the whole run. The latest /odom pose is
+    # cached from a background subscription so yaw/position reads never block.
+
+    def __init__(self, node_name='turtlebot_motion', publisher=None, subscribe=True):
+        if publisher is None:
+            rospy.init_node(node_name, anonymous=True)
+            publisher = rospy.Publisher('/mobile_base/commands/velocity', Twist, queue_size=10)
+            self._wait_for_subscriber(publisher)
+        self.pub = publisher
+
+        self._pose = None
+        self._pose_lock = threading.Lock()
+        self._pose_ready = threading.Event()
+        self.odom_sub = None
+        if subscribe:
+            self.odom_sub = rospy.Subscriber("/odom", Odometry, self._on_odom, queue_size=1)
+
+    @staticmethod
+    def _wait_for_subscriber(pub, timeout=1.0):
+        # Replaces the fixed rospy.sleep(1.0): only wait until the base is connected, and only once
+        deadline = time.monotonic() + timeout
+        while pub.get_num_connections() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _on_odom(self, msg):
+        orientation_q = msg.pose.pose.orientation
+        quaternion = (
+            orientation_q.x,
+            orientation_q.y,
+            orientation_q.z,
+            orientation_q.w
+        )
+        (roll, pitch, yaw) = tf.transformations.euler_from_quaternion(quaternion)
+        position = msg.pose.pose.position
+        self.update_pose(position.x, position.y, yaw, msg.header.stamp.to_sec())
+
+    def update_pose(self, x, y, yaw, stamp=None):
+        with self._pose_lock:
+            self._pose = Pose(x, y, yaw, time.time() if stamp is None else stamp)
+        self._pose_ready.set()
+
+    def pose(self, timeout=5.0):
+        # Only the very first read waits, for the first odometry message to arrive
+        if not self._pose_ready.wait(timeout):
+            raise RuntimeError("No odometry received on /odom")
+        with self._pose_lock:
+            return self._pose
+
+    def get_yaw(self, log=False):
+        yaw = self.pose().yaw
+        if log:
+            rospy.loginfo("Bearing (Yaw): {:.2f} degrees".format(math.degrees(yaw)))
+        return yaw
+
+    def get_position(self):
+        pose = self.pose()
+        return pose.x, pose.y
+
+    def publish(self, linear=0.0, angular=0.0):
+        move_cmd = Twist()
+        move_cmd.linear.x = linear
+        move_cmd.angular.z = angular
+        self.pub.publish(move_cmd)
+
+    def stop(self):
+        self.pub.publish(Twist())
+
+    def move_backwards(self):
+        rate = rospy.Rate(10)  # 10 Hz
+
+        # Publish for a short time (e.g., 2 seconds)
+        timeout = time.monotonic() + 2.0
+        while time.monotonic() < timeout and not rospy.is_shutdown():
+            self.publish(linear=-0.1)  # Move backwards
+            rate.sleep()
 
-    move_cmd = Twist()
-    move_cmd.linear.x = -0.1  # Move backwards
-    move_cmd.angular.z = 0.0  # No rotation
+        # Stop the robot
+        self.stop()
+
+    def move(self, move_val):
+        self.publish(linear=move_val)
+        rospy.loginfo("Published one velocity command.")
+
+    def rotate_to(self, desired_yaw, controller=None):
+        # Closed-loop turn to an absolute heading; settles when the error stays inside the
+        # tolerance for settle_time seconds. Returns the achieved error and elapsed time.
+        pid = controller or HeadingController()
+        pid.reset()
+        period = 1.0 / pid.rate_hz
+        desired_yaw = wrap_angle(desired_yaw)
+
+        with span("rotate_to", target=desired_yaw) as s:
+            start = time.monotonic()
+            last = start
+            inside_since = None
+            settled = False
+            while not rospy.is_shutdown():
+                now = time.monotonic()
+                error = wrap_angle(desired_yaw - self.get_yaw())
+                if abs(error) <= pid.tolerance:
+                    inside_since = now if inside_since is None else inside_since
+                    if now - inside_since >= pid.settle_time:
+                        settled = True
+                        break
+                else:
+                    inside_since = None
+                if now - start > pid.timeout:
+                    break
+
+                self.publish(angular=pid.update(error, max(now - last, 1e-3)))
+                last = now
+                time.sleep(max(0.0, period - (time.monotonic() - now)))
+
+            # Stop
+            self.stop()
+            error = wrap_angle(desired_yaw - self.get_yaw())
+            s.set(error=error, settled=settled)
+            if not settled:
+                event("rotate_timeout", target=desired_yaw, error=error)
+        return HeadingResult(error, time.monotonic() - start, settled)
+
+    def move_distance(self, meters, max_speed=0.2, max_accel=0.3, min_speed=0.02,
+                      tolerance=0.003, rate_hz=40, heading_kp=1.5, timeout=None):
+        # Drives a signed distance along the current heading (negative = backwards) with a
+        # trapezoidal speed profile closed on odometry: accelerate at max_accel, cruise at
+        # max_speed, and brake so speed reaches zero exactly at the target.
+        start_pose = self.pose()
+        cos_h, sin_h = math.cos(start_pose.yaw), math.sin(start_pose.yaw)
+        direction = math.copysign(1.0, meters)
+        distance = abs(meters)
+        if timeout is None:
+            timeout = 3.0 + 2.0 * distance / max_speed
+        period = 1.0 / rate_hz
+
+        with span("move_distance", meters=meters) as s:
+            start = time.monotonic()
+            last = start
+            speed = 0.0
+            reached = False
+            while not rospy.is_shutdown():
+                now = time.monotonic()
+                pose = self.pose()
+                travelled = direction * ((pose.x - start_pose.x) * cos_h + (pose.y - start_pose.y) * sin_h)
+                remaining = distance - travelled
+                if remaining <= tolerance:
+                    reached = True
+                    break
+                if now - start > timeout:
+                    break
+
+                dt = max(now - last, 1e-3)
+                speed = min(max_speed, speed + max_accel * dt, math.sqrt(2 * max_accel * remaining))
+                speed = max(speed, min_speed)
+                # Hold the starting heading while driving so rows stay straight
+                angular = heading_kp * wrap_angle(start_pose.yaw - pose.yaw)
+                self.publish(linear=direction * speed, angular=max(-0.3, min(0.3, angular)))
+                last = now
+                time.sleep(max(0.0, period - (time.monotonic() - now)))
+
+            # Stop
+            self.stop()
+            pose = self.pose()
+            travelled = direction * ((pose.x - start_pose.x) * cos_h + (pose.y - start_pose.y) * sin_h)
+            s.set(error=direction * (distance - travelled), reached=reached)
+            if not reached:
+                event("move_timeout", meters=meters, travelled=direction * travelled)
+        return MoveResult(direction * (distance - travelled), time.monotonic() - start, reached)
+
+    def turn_90_degrees(self, clockwise=False):
+        yaw = self.get_yaw(log=True)
+        if clockwise:
+            desired_yaw = yaw - math.pi/2
+        else:
+            desired_yaw = yaw + math.pi/2
 
-    # Publish for a short time (e.g., 2 seconds)
-    timeout = rospy.Time.now() + rospy.Duration(2.0)
-    while rospy.Time.now() < timeout and not rospy.is_shutdown():
-        pub.publish(move_cmd)
-        rate.sleep()
+        result = self.rotate_to(desired_yaw)
+        rospy.loginfo("Completed 90-degree turn: error {:.3f} rad in {:.2f} s".format(result.error, result.elapsed))
+        self.get_yaw(log=True)
+        return result
 
-    # Stop the robot
-    stop_cmd = Twist()
-    pub.publish(stop_cmd)
+    def correct_yaw(self, desired_yaw):
+        with span("correct_yaw"):
+            return self.rotate_to(desired_yaw)
 
+_controller = None
+_controller_lock = threading.Lock()
 
-def publish_once():
-    rospy.init_node('turtlebot_publish_once', anonymous=True)
-    pub = rospy.Publisher('/mobile_base/commands/velocity', Twist, queue_size=10)
+def get_controller():
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = MotionController()
+        return _controller
 
-    # Wait for the publisher to establish connection
-    rospy.sleep(1.0)
+def get_yaw_once(log = False):
+    return get_controller().get_yaw(log)
 
-    move_cmd = Twist()
-    move_cmd.linear.x = -0.1  # Move backward
-    move_cmd.angular.z = 0.0
+def move_backwards():
+    get_controller().move_backwards()
 
-    pub.publish(move_cmd)
+def publish_once():
+    get_controller().publish(linear=-0.1)  # Move backward
     rospy.loginfo("Published one velocity command.")
 
 def move(move_val):
-    rospy.init_node('turtlebot_turn_90', anonymous=True)
-    pub = rospy.Publisher('/mobile_base/commands/velocity', Twist, queue_size=10)
-
-    # Wait for the publisher to establish connection
-    rospy.sleep(1.0)
+    get_controller().move(move_val)
 
-    move_cmd = Twist()
-    move_cmd.linear.x = move_val  # Move backward
-    move_cmd.angular.z = 0.0
-
-    pub.publish(move_cmd)
-    rospy.loginfo("Published one velocity command.")
+def move_distance(meters, max_speed=0.2):
+    return get_controller().move_distance(meters, max_speed)
 
 def turn_90_degrees(clockwise=False):
-    rospy.init_node('turtlebot_turn_90', anonymous=True)
-    pub = rospy.Publisher('/mobile_base/commands/velocity', Twist, queue_size=10)
-    rospy.sleep(1.0)
-
-    yaw = get_yaw_once(log = True)
-
-    # Desired angle and angular speed
-    angular_speed = 0.25  # radians/sec (safe value for TurtleBot2)
-
-    if clockwise:
-        desired_yaw = yaw - math.pi/2
-    else:
-        desired_yaw = yaw + math.pi/2
-
-    if clockwise:
-        angular_speed = -abs(angular_speed)
-    else:
-        angular_speed = abs(angular_speed)
-
-    move_cmd = Twist()
-    move_cmd.angular.z = angular_speed
-
-    rate = rospy.Rate(10)  # 10 Hz
-
-    if clockwise:
-        while yaw > desired_yaw:
-            yaw = get_yaw_once()
-            pub.publish(move_cmd)
-            rate.sleep()
-    else:
-        while yaw < desired_yaw:
-            yaw = get_yaw_once()
-            pub.publish(move_cmd)
-            rate.sleep()
-
-    
-
-    # Stop
-    stop_cmd = Twist()
-    pub.publish(stop_cmd)
-
-    rospy.loginfo("Completed 90-degree turn")
-    yaw = get_yaw_once(log = True)
+    return get_controller().turn_90_degrees(clockwise)
 
 def correct_yaw(desired_yaw):
-    rospy.init_node('turtlebot_turn_90', anonymous=True)
-    pub = rospy.Publisher('/mobile_base/commands/velocity', Twist, queue_size=10)
-    rospy.sleep(1.0)
-    #print("Desired yaw: ", desired_yaw)
-    yaw = get_yaw_once(log = False)
-
-    # Desired angle and angular speed
-    angular_speed = 0.15  # radians/sec (safe value for TurtleBot2)
-
-    move_cmd = Twist()
-    move_cmd.angular.z = angular_speed
-
-    rate = rospy.Rate(10)  # 10 Hz
-
-    #print("Yaw diff: ", abs(desired_yaw - yaw))
-
-    while abs(desired_yaw - yaw) > 0.07:
-        if desired_yaw - yaw < 0:
-            angular_speed = -0.25
-            move_cmd.angular.z = angular_speed
-            yaw = get_yaw_once(log = False)
-            pub.publish(move_cmd)
-            rate.sleep()
-        else:
-            angular_speed = 0.25
-            move_cmd.angular.z = angular_speed
-            yaw = get_yaw_once(log = False)
-            pub.publish(move_cmd)
-            rate.sleep()
-    
-
-    # Stop
-    stop_cmd = Twist()
-    pub.publish(stop_cmd)
-
-    #rospy.loginfo("Corrected Yaw")
-    yaw = get_yaw_once(log = False)
+    return get_controller().correct_yaw(desired_yaw)
 
-def move_next_row():
-    turn_90_degrees(clockwise=False)
-    time.sleep(0.1)
-    move(-0.5)
-    time.sleep(0.1)
-    turn_90_degrees(clockwise=True)
+def move_next_row(row_spacing=ROW_SPACING):
+    with span("move_next_row"):
+        turn_90_degrees(clockwise=False)
+        move_distance(-row_spacing, max_speed=0.3)
+        turn_90_degrees(clockwise=True)
 
 #move(-0.2)
 
@@ -1,39 +1,37 @@
 import threading
 import tkinter as tk
 from tkinter import messagebox
-from PIL import Image, ImageTk, ImageEnhance
+from PIL import ImageTk
+from image_pipeline import decode_preview
 import requests
+from photo_client import PhotoClient
 from bs4 import BeautifulSoup
 from pathlib import Path
 from datetime import datetime
 
 # Configuration
 SERVER_IP = "10.159.66.216"
-PHOTO_URL = f"http://{SERVER_IP}:8000/take_photo"
-PING_URL = f"http://{SERVER_IP}:8000/ping"
+CAMERA_URL = f"http://{SERVER_IP}:8000"
 ARDUINO_ADDR = "48:27:E2:E1:51:DD"
 CHAR_UUID = "6e400002-b5a3-f393-e0a9-e50e24dcca9e"  # write to BLE characteristic UUID
 SAVE_DIR = Path.home() / "Downloads" / "SnapdragonPhotos"
 SAVE_DIR.mkdir(parents=True, exist_ok=True)
+photo_client = PhotoClient(CAMERA_URL)  # keep-alive pool shared by every photo request
 def save_and_process_image(raw_bytes):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filepath = SAVE_DIR / f"photo_{timestamp}.jpg"
     with open(filepath, "wb") as f:
         f.write(raw_bytes)
-    img = Image.open(filepath).resize((400, 300), Image.Resampling.LANCZOS)
-    img = ImageEnhance.Contrast(img).enhance(1.5)
-    img = ImageEnhance.Brightness(img).enhance(1.3)
-    return filepath, ImageTk.PhotoImage(img)
+    return filepath, ImageTk.PhotoImage(decode_preview(raw_bytes))
 
-def check_connection(label_widget, url):
+def check_connection(label_widget, client):
     def task():
-        try:
-            res = requests.get(url, timeout=3)
-            if res.status_code == 200 and "pong" in res.text.lower():
-                label_widget.config(text="good", fg="green")
-            else:
-                label_widget.config(text="warning", fg="orange")
-        except:
+        status = client.ping()
+        if status == "good":
+            label_widget.config(text="good", fg="green")
+        elif status == "warning":
+            label_widget.config(text="warning", fg="orange")
+        else:
             label_widget.config(text="bad", fg="red")
     threading.Thread(target=task).start()
 
@@ -48,7 +46,7 @@ class SnapdragonCameraApp:
 
         self._build_gui()
 
-        check_connection(self.snapdragon_conn_icon, PING_URL)
+        check_connection(self.snapdragon_conn_icon, photo_client)
 
     def _build_gui(self):
         main_frame = tk.Frame(self.root, bg="white")
@@ -88,16 +86,15 @@ class SnapdragonCameraApp:
         def task():
             self.status_var.set("Taking photo...")
             try:
-                res = requests.get(PHOTO_URL, timeout=30)
-                if res.status_code == 200:
-                    filepath, tk_img = save_and_process_image(res.content)
-                    self.image_label.config(image=tk_img)
-                    self.image_label.image = tk_img
-                    self.status_var.set(f"Saved: {filepath.name}")
-                    print(f"[INFO] Saved image to: {filepath}")
-                else:
-                    self.status_var.set(f"Server error: {res.status_code}")
-                    messagebox.showerror("Error", f"Server error: {res.status_code}")
+                photo = photo_client.take_photo()
+                filepath, tk_img = save_and_process_image(photo.data)
+                self.image_label.config(image=tk_img)
+                self.image_label.image = tk_img
+                self.status_var.set(f"Saved: {filepath.name}")
+                print(f"[INFO] Saved image to: {filepath} ({photo.latency * 1000:.0f} ms)")
+            except requests.HTTPError as e:
+                self.status_var.set(f"Server error: {e.response.status_code}")
+                messagebox.showerror("Error", f"Server error: {e.response.status_code}")
             except Exception as e:
                 self.status_var.set("Failed to connect")
                 messagebox.showerror("Error", f"Failed to get photo:\n{e}")
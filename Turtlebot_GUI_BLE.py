@@ -1,74 +1,63 @@
 import threading
-import asyncio
 import tkinter as tk
 from tkinter import messagebox
-from PIL import Image, ImageTk, ImageEnhance
 import requests
+from photo_client import PhotoClient
 from bs4 import BeautifulSoup
 from pathlib import Path
 from datetime import datetime
-from bleak import BleakClient
-import numpy as np
-from signalpow import get_vector
-import time
-from Move import move, move_next_row, correct_yaw, get_yaw_once
+from ble_session import BleSession
+from signalpow import PowerService
+from Move import move_distance, move_next_row, correct_yaw, get_yaw_once, get_controller, STEP_DISTANCE
+from capture_pipeline import CapturePipeline, survey_stages, print_summary
+from image_pipeline import TkDispatcher, PreviewPipeline
+from shards import SURVEY_BEAMS, ShardWriter
+from guided_sweep import GuidedSweep
+from tracing import tracer, span, event
 import math
 
 # Configuration
 SERVER_IP = "10.159.64.80"
-PHOTO_URL = f"http://{SERVER_IP}:8000/take_photo"
-PING_URL = f"http://{SERVER_IP}:8000/ping"
+CAMERA_URL = f"http://{SERVER_IP}:8000"
 SAVE_DIR = Path.home() / "QualcommDataset/v6"
 SAVE_DIR.mkdir(parents=True, exist_ok=True)
+photo_client = PhotoClient(CAMERA_URL)  # keep-alive pool shared by every photo request
 ARDUINO_ADDR = "48:27:E2:E1:51:DD"
 CHAR_UUID = "6e400002-b5a3-f393-e0a9-e50e24dcca9e"  # write to BLE characteristic UUID
+SHARD_DIR = SAVE_DIR / "shards"  # packed dataset: images, beam powers and poses
+SHARD_RECORDS = 512  # samples per shard; bounds what is lost if the GUI is killed mid-shard
+RECORD_IQ = False  # tee raw IQ (8 MB/s) to SAVE_DIR for offline replay
+DECIMATE_POWER = False  # take the power at 20 kS/s after decimating: same bandwidth, a fraction of the CPU
+PREVIEW_SIZE = (400, 300)
+BEAMS = SURVEY_BEAMS  # beam order of the stored powers; beam 2 is left out of the current survey
+BLE_ATTEMPTS = 5
+ADAPTIVE_SETTLE = True  # measure each beam as soon as its power is stable instead of after a fixed skip
+SETTLE_CI_DB = 0.25  # stable = 95% confidence interval of the mean within +/- this
+SETTLE_TIMEOUT = 0.5  # s; after this the latest window is used and the beam is flagged
+CONTINUOUS_SWEEP = False  # cut all beam powers from one stream, between the switch markers
+SWEEP_DWELL_MS = 8.0  # beam hold time after each acknowledged switch in a continuous sweep
+GUIDED_SWEEP = False  # measure only the beams the model ranks highest (see inference.py to export it)
+MODEL_PATH = "exported/vit_tiny_int8.pt"
+GUIDE_TOP_K = 2
+GUIDE_MIN_CONFIDENCE = 0.6  # combined top-k probability below this -> full sweep
+GUIDE_AUDIT_EVERY = 25  # full sweep every N samples to keep measuring the model's accuracy
+TRACE = False  # record timing spans; written to SAVE_DIR as a Chrome/Perfetto trace
+SURVEY_ROWS = 8
+SAMPLES_PER_ROW = 76
 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 running = False
 
-def save_and_process_image(raw_bytes, timestamp):
-    filepath = SAVE_DIR / f"{timestamp}.jpg"
-    with open(filepath, "wb") as f:
-        f.write(raw_bytes)
-    img = Image.open(filepath).resize((400, 300), Image.Resampling.LANCZOS)
-    img = ImageEnhance.Contrast(img).enhance(1.5)
-    img = ImageEnhance.Brightness(img).enhance(1.3)
-    return filepath, ImageTk.PhotoImage(img)
-
-def check_connection(label_widget, url):
+def check_connection(label_widget, client, ui):
     def task():
-        try:
-            res = requests.get(url, timeout=3)
-            if res.status_code == 200 and "pong" in res.text.lower():
-                label_widget.config(text="good", fg="green")
-            else:
-                label_widget.config(text="warning", fg="orange")
-        except:
-            label_widget.config(text="bad", fg="red")
+        status = client.ping()
+        if status == "good":
+            ui.call(label_widget.config, text="good", fg="green")
+        elif status == "warning":
+            ui.call(label_widget.config, text="warning", fg="orange")
+        else:
+            ui.call(label_widget.config, text="bad", fg="red")
     threading.Thread(target=task).start()
 
-async def send_ble_command(command):
-    try:
-        async with BleakClient(ARDUINO_ADDR) as client:
-            await client.write_gatt_char(CHAR_UUID, command.encode())
-            return True
-    except Exception as e:
-        print(f"[BLE Error] {e}")
-        return False
-
-async def check_ble_connection():
-    try:
-        async with BleakClient(ARDUINO_ADDR) as client:
-            if await client.is_connected():
-                return True
-    except Exception as e:
-        print(f"[BLE] Not connected: {e}")
-    return False
-
-def get_arduino_status():
-    import asyncio
-    is_connected = asyncio.run(check_ble_connection())
-    return "Connected" if is_connected else "Disconnected"
-
 class SnapdragonCameraApp:
     running = False
     def __init__(self, root):
@@ -78,10 +67,38 @@ class SnapdragonCameraApp:
         self.root.configure(bg="white")
 
         self.auto_capturing = False
+        if TRACE:
+            tracer.enable()
+
+        # Worker threads hand UI updates to the Tk main thread through this queue;
+        # previews are decoded and files written off the main thread
+        self.ui = TkDispatcher(root)
+        self.previews = PreviewPipeline(self.ui, size=PREVIEW_SIZE)
+
+        # One BLE connection for the whole session instead of one per command
+        self.ble = BleSession(ARDUINO_ADDR, CHAR_UUID)
+        self.ble.connect_async()
+
+        # Flowgraph runs for the whole session; each measurement reads its ring buffer.
+        # The raw IQ is also recorded so power extraction can be re-run offline.
+        record_path = SAVE_DIR / f"iq_{timestamp}.fc32" if RECORD_IQ else None
+        self.power = PowerService(record_path=record_path, decimating=DECIMATE_POWER).start()
+
+        # Samples are appended to packed shards instead of one .jpg + .npy pair each
+        self.dataset = ShardWriter(SHARD_DIR, BEAMS, max_records=SHARD_RECORDS,
+                                   meta={"server": SERVER_IP, "arduino": ARDUINO_ADDR})
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        self.guide = None
+        if GUIDED_SWEEP:
+            from inference import BeamPredictor
+            self.guide = GuidedSweep(BeamPredictor(MODEL_PATH, num_threads=2), BEAMS, top_k=GUIDE_TOP_K,
+                                     min_confidence=GUIDE_MIN_CONFIDENCE, audit_every=GUIDE_AUDIT_EVERY,
+                                     log_path=SAVE_DIR / "guided_sweep.jsonl")
 
         self._build_gui()
 
-        check_connection(self.snapdragon_conn_icon, PING_URL)
+        check_connection(self.snapdragon_conn_icon, photo_client, self.ui)
         self.update_arduino_status()
 
     def _build_gui(self):
@@ -141,42 +158,44 @@ class SnapdragonCameraApp:
                             command=self.full_system_run, width=22)
         run_all_btn.pack(pady=5)
 
+    def on_close(self):
+        self.export_trace()
+        self.dataset.close()
+        self.previews.shutdown()
+        self.ble.close()
+        self.power.stop()
+        self.root.destroy()
+
+    def export_trace(self):
+        if tracer.enabled:
+            tracer.print_summary()
+            tracer.export_chrome(SAVE_DIR / f"trace_{timestamp}.json")
+
+    def set_status(self, text):
+        self.ui.call(self.status_var.set, text)
+
+    def save_photo(self, raw_bytes, timestamp):
+        filepath = SAVE_DIR / f"{timestamp}.jpg"
+        self.previews.save(filepath, raw_bytes)
+        self.previews.show(raw_bytes, self.image_label)
+        return filepath
+
     def take_photo(self):
         def task():
-            self.status_var.set("Taking photo...")
+            self.set_status("Taking photo...")
             try:
-                res = requests.get(PHOTO_URL, timeout=30)
-                if res.status_code == 200:
-                    filepath, tk_img = save_and_process_image(res.content, timestamp)
-                    self.image_label.config(image=tk_img)
-                    self.image_label.image = tk_img
-                    self.status_var.set(f"Saved: {filepath.name}")
-                    print(f"[INFO] Saved image to: {filepath}")
-                else:
-                    self.status_var.set(f"Server error: {res.status_code}")
-                    messagebox.showerror("Error", f"Server error: {res.status_code}")
+                photo = photo_client.take_photo()
+                filepath = self.save_photo(photo.data, timestamp)
+                self.set_status(f"Saved: {filepath.name}")
+                print(f"[INFO] Saved image to: {filepath} ({photo.latency * 1000:.0f} ms)")
+            except requests.HTTPError as e:
+                self.set_status(f"Server error: {e.response.status_code}")
+                self.ui.call(messagebox.showerror, "Error", f"Server error: {e.response.status_code}")
             except Exception as e:
-                self.status_var.set("Failed to connect")
-                messagebox.showerror("Error", f"Failed to get photo:\n{e}")
+                self.set_status("Failed to connect")
+                self.ui.call(messagebox.showerror, "Error", f"Failed to get photo:\n{e}")
         threading.Thread(target=task).start()
 
-    def take_photo_now(self, timestamp):
-        self.status_var.set("Taking photo...")
-        try:
-            res = requests.get(PHOTO_URL, timeout=30)
-            if res.status_code == 200:
-                filepath, tk_img = save_and_process_image(res.content, timestamp)
-                self.image_label.config(image=tk_img)
-                self.image_label.image = tk_img
-                self.status_var.set(f"Saved: {filepath.name}")
-                print(f"[INFO] Saved image to: {filepath}")
-            else:
-                self.status_var.set(f"Server error: {res.status_code}")
-                messagebox.showerror("Error", f"Server error: {res.status_code}")
-        except Exception as e:
-                self.status_var.set("Failed to connect")
-                messagebox.showerror("Error", f"Failed to get photo:\n{e}")
-
     def toggle_auto_capture(self):
         self.auto_capturing = not self.auto_capturing
         if self.auto_capturing:
@@ -184,7 +203,7 @@ class SnapdragonCameraApp:
             self.schedule_auto_capture()
         else:
             self.auto_btn.config(text="Start Auto Capture")
-            self.status_var.set("Auto capture stopped.")
+            self.set_status("Auto capture stopped.")
 
     def schedule_auto_capture(self):
         if self.auto_capturing:
@@ -193,106 +212,175 @@ class SnapdragonCameraApp:
 
     def arduino_command(self, cmd):
         if not cmd:
-            self.status_var.set("Command is empty.")
+            self.set_status("Command is empty.")
             return False
-        success = asyncio.run(send_ble_command(cmd))
-        if success:
-            self.status_var.set(f"Sent: '{cmd}'")
-            print(f"[INFO]: Sent: '{cmd}'")
+        latency = self.ble.send(cmd)
+        if latency is not None:
+            latency_ms = latency * 1000
+            self.set_status(f"Sent: '{cmd}' ({latency_ms:.0f} ms)")
+            print(f"[INFO]: Sent: '{cmd}' in {latency_ms:.1f} ms")
             return True
         else:
-            self.status_var.set("Failed to send BLE command.")
+            self.set_status("Failed to send BLE command.")
             print("Failed to send BLE command. - arduinocommand")
             return False
 
     def update_arduino_status(self):
         def task():
-            led_status = get_arduino_status()
-            if "Connected" in led_status:
-                self.arduino_conn_icon.config(text="Good")
-            elif "Disconnected" in led_status:
-                self.arduino_conn_icon.config(text="Bad")
-            self.root.after(5000, self.update_arduino_status)
+            if self.ble.is_connected():
+                self.ui.call(self.arduino_conn_icon.config, text="Good")
+            else:
+                self.ui.call(self.arduino_conn_icon.config, text="Bad")
+                self.ble.connect_async()
+            self.ui.call(self.root.after, 5000, self.update_arduino_status)
         threading.Thread(target=task).start()
     
     def send_ble_command_from_input(self):
         command = self.ble_command_var.get().strip()
         if not command:
-            self.status_var.set("Command is empty.")
+            self.set_status("Command is empty.")
             return
-        success = asyncio.run(send_ble_command(command))
-        if success:
-            self.status_var.set(f"Sent: '{command}'")
+        latency = self.ble.send(command)
+        if latency is not None:
+            self.set_status(f"Sent: '{command}' ({latency * 1000:.0f} ms)")
         else:
-            self.status_var.set("Failed to send BLE command.")
-
-    def capture_data(self):
-        #if running:
-        #    print("[INFO] Trying to run while again while running. Only click once!")
-           
-        wait_time = 0.01   
-        success = False
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        signal_strength = []
-        self.take_photo_now(timestamp)
-        time.sleep(wait_time)
-        while(not success):
-            success = self.arduino_command("0")
-        time.sleep(wait_time)
-        signal_strength.append(np.array(get_vector()).mean())
-
-        success = False
-        while(not success):
-            success = self.arduino_command("1")
-        time.sleep(wait_time)
-        signal_strength.append(np.array(get_vector()).mean())
-
-        # success = False
-        # while(not success):
-        #     success = self.arduino_command("2")
-        # time.sleep(wait_time)
-        # signal_strength.append(np.array(get_vector()).mean())
-        
-        success = False
-        while(not success):
-            success = self.arduino_command("3")
-        time.sleep(wait_time)
-        signal_strength.append(np.array(get_vector()).mean())
-
-        success = False
-        while(not success):
-            success = self.arduino_command("4")
-        time.sleep(wait_time)
-        signal_strength.append(np.array(get_vector()).mean())
-
-        self.status_var.set("Signal Strength List: " + str(signal_strength))
-        np.save( "/home/dolly/QualcommDataset/v6/" + timestamp + '.npy', np.array(signal_strength))
-        print(f"[INFO] Finished running: " + str(signal_strength))
-        print(np.argmax(signal_strength))
+            self.set_status("Failed to send BLE command.")
+
+    def switch_beam(self, beam, timestamp):
+        for attempt in range(1, BLE_ATTEMPTS + 1):
+            with span("switch_beam", beam=beam, attempt=attempt) as s:
+                success = self.arduino_command(beam)
+                s.set(success=success)
+            if success:
+                self.power.mark(f"{timestamp} beam {beam}")
+                return attempt
+            event("beam_switch_retry", beam=beam, attempt=attempt)
+        raise RuntimeError(f"Could not switch to beam {beam} after {BLE_ATTEMPTS} attempts")
+
+    def sweep_beams(self, timestamp, beams=BEAMS):
+        # Powers in BEAMS order; beams not in `beams` are left as NaN
+        if CONTINUOUS_SWEEP:
+            return self.sweep_continuous(timestamp, beams)
+        signal_strength = [math.nan] * len(BEAMS)
+        for beam in beams:
+            with span("beam", beam=beam):
+                self.switch_beam(beam, timestamp)
+                signal_strength[BEAMS.index(beam)] = self.measure_power(beam)
+        return signal_strength
+
+    def sweep_continuous(self, timestamp, beams=BEAMS):
+        # Switch through the beams without stopping to measure, then split the stream
+        signal_strength = [math.nan] * len(BEAMS)
+        if self.power.latency_ms is None:
+            # Once per session: how far the stream lags the switch markers
+            self.power.calibrate_latency(lambda beam: self.switch_beam(beam, timestamp), BEAMS)
+        sweep = self.power.begin_sweep(dwell_ms=SWEEP_DWELL_MS, ci_db=SETTLE_CI_DB)
+        for beam in beams:
+            with span("beam", beam=beam):
+                sweep.before_switch(beam)
+                self.switch_beam(beam, timestamp)
+                sweep.after_switch(beam)
+        for beam, measurement in sweep.finish().items():
+            signal_strength[BEAMS.index(beam)] = measurement.power
+            if not measurement.settled:
+                print(f"[WARN] Beam {beam} was not stable in its sweep window")
+        return signal_strength
+
+    def measure_power(self, beam):
+        if not ADAPTIVE_SETTLE:
+            return self.power.measure().power
+        measurement = self.power.measure_settled(ci_db=SETTLE_CI_DB, timeout=SETTLE_TIMEOUT)
+        if not measurement.settled:
+            print(f"[WARN] Beam {beam} did not settle within {SETTLE_TIMEOUT} s "
+                  f"(+/-{measurement.ci_db:.2f} dB)")
+        return measurement.power
 
     def full_system_run(self):
-        #self.capture_data()
+        # The survey runs off the Tk main thread so the window stays responsive
+        threading.Thread(target=self.run_survey, daemon=True).start()
+
+    def run_survey(self, rows=SURVEY_ROWS, samples_per_row=SAMPLES_PER_ROW):
         start_yaw = get_yaw_once(True)
-        vel = 0.125
-        for num in range(8):
-            print("[INFO] Starting row: ", num)
-            for num2 in range(76): # 76
-                print("[INFO] Starting sample number: ", num2)
-                self.capture_data()
-                move(vel)
+
+        def move_to(ctx):
+            # Move away from the previous sample: one step along the row, then a row change
+            # after the last sample of a row. Rows alternate direction.
+            # Returns the pose the sample is taken at.
+            if ctx.index > 0:
+                row, col = divmod(ctx.index - 1, samples_per_row)
+                move_distance(STEP_DISTANCE if row % 2 == 0 else -STEP_DISTANCE)
                 correct_yaw(start_yaw)
-            move_next_row()
-            vel = vel*-1
-            time.sleep(0.1)
-            #start_yaw = (start_yaw + math.pi) % (2*math.pi) - math.pi
+                if col == samples_per_row - 1:
+                    print("[INFO] Starting row: ", row + 1)
+                    move_next_row()
+            return get_controller().pose()
+
+        def fetch_photo(ctx):
+            # Only a preview-sized copy is on the critical path; persist() fetches the
+            # full-resolution frame for the dataset afterwards
+            photo = photo_client.take_photo(size=PREVIEW_SIZE, quality=80)
+            self.previews.show(photo.data, self.image_label)
+            return photo
+
+        def plan(ctx):
+            # Guided mode: the model ranks the beams from the full-resolution frame, the
+            # size it was trained on; persist() stores the same frame
+            with span("fetch_frame"):
+                full = photo_client.fetch_frame(ctx.results["photo"].frame_id)
+            return full, self.guide.plan(full.data)
+
+        def sweep(ctx):
+            # Full sweep, or only the beams the model ranks highest when guided mode is on
+            beams = ctx.results["plan"][1].beams if "plan" in ctx.results else BEAMS
+            return self.sweep_beams(ctx.started.strftime("%Y%m%d_%H%M%S"), beams)
+
+        def persist(ctx):
+            if "plan" in ctx.results:
+                full, sweep_plan = ctx.results["plan"]
+            else:
+                with span("fetch_frame"):
+                    full = photo_client.fetch_frame(ctx.results["photo"].frame_id)
+                sweep_plan = None
+            pose = ctx.results["motion"]
+            row, col = divmod(ctx.index, samples_per_row)
+            with span("dataset_append"):
+                self.dataset.append(full.data, ctx.results["sweep"], timestamp=ctx.started.timestamp(),
+                                    name=ctx.started.strftime("%Y%m%d_%H%M%S"),
+                                    x=pose.x, y=pose.y, yaw=pose.yaw, row=row, col=col)
+            print(f"[INFO] Finished running: " + str(ctx.results["sweep"]))
+            if sweep_plan is not None:
+                # Last, so a persist retried after a failed append records the sample once
+                self.guide.record(sweep_plan, ctx.results["sweep"], ctx.started.strftime("%Y%m%d_%H%M%S"))
+
+        def on_sample(ctx, pipeline):
+            elapsed = (datetime.now() - pipeline.samples[0].started).total_seconds()
+            row, col = divmod(ctx.index, samples_per_row)
+            status = f"Row {row} sample {col}: {pipeline.samples_per_minute(elapsed):.1f} samples/min"
+            slowest = pipeline.bottleneck()
+            if slowest is not None:
+                status += f", slowest: {slowest[0]} ({slowest[1]:.1f} s)"
+            if self.guide is not None:
+                status += ", " + self.guide.status()
+            self.set_status(status)
+
+        stages = survey_stages(move_to, fetch_photo, sweep, persist, plan=plan if self.guide is not None else None)
+        pipeline = CapturePipeline(stages, on_sample=on_sample)
+        try:
+            summary = pipeline.run(rows * samples_per_row)
+        except Exception as e:
+            self.set_status(f"Survey stopped: {e}")
+            print(f"[ERROR] Survey stopped: {e}")
+            return None
+        finally:
+            self.dataset.flush()
+            self.export_trace()
+        print_summary(summary)
+        if self.guide is not None:
+            print(f"[INFO] Guided sweep: {self.guide.summary()}")
+        self.set_status(f"Survey done: {summary['samples_per_min']:.1f} samples/min")
+        return summary
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = SnapdragonCameraApp(root)
     root.mainloop()
-
-
-
-
-
-
@@ -0,0 +1,211 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from bleak import BleakClient
+
+from tracing import event, span
+
+
+async def _is_connected(client):
+    # Older bleak releases expose is_connected() as a coroutine, newer ones as a property
+    connected = client.is_connected
+    if callable(connected):
+        connected = await connected()
+    return bool(connected)
+
+
+class BleSession:
+    """Long-lived BLE connection shared by every command sender."""
+
+    def __init__(self, address, char_uuid, client_factory=BleakClient,
+                 write_timeout=5.0, min_backoff=0.25, max_backoff=8.0, max_attempts=5, history=500):
+        self.address = address
+        self.char_uuid = char_uuid
+        self.client_factory = client_factory
+        self.write_timeout = write_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+
+        self.client = None
+        self.latencies = deque(maxlen=history)  # seconds per successful send()
+        self.reconnects = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._lock = asyncio.Lock()
+        self._thread = threading.Thread(target=self._run_loop, name="ble-session", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _on_disconnect(self, client):
+        print("[BLE] Disconnected from", self.address)
+        if self.client is client:
+            self.client = None
+            self._submit(self._close_client(client))  # release the dropped client's resources
+
+    # --------------------- Event loop side ---------------------
+
+    async def _close_client(self, client):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            print(f"[BLE] Disconnect of dropped client failed: {e}")
+
+    async def _drop_client(self):
+        client, self.client = self.client, None
+        if client is not None:
+            await self._close_client(client)
+
+    async def _ensure_connected(self):
+        # Serialised with writes; asyncio.Lock is not re-entrant, so _send uses _connect
+        async with self._lock:
+            return await self._connect()
+
+    async def _connect(self):
+        if self.client is not None and await _is_connected(self.client):
+            return self.client
+
+        backoff = self.min_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with span("ble_connect", attempt=attempt):
+                    client = self.client_factory(self.address, disconnected_callback=self._on_disconnect)
+                    await client.connect()
+                self.client = client
+                self.reconnects += 1
+                return client
+            except Exception as e:
+                print(f"[BLE] Connect attempt {attempt}/{self.max_attempts} failed: {e}")
+                event("ble_connect_retry", attempt=attempt, error=str(e))
+                if attempt == self.max_attempts:
+                    raise
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _send(self, command):
+        async with self._lock:
+            for attempt in range(2):
+                client = await self._connect()
+                try:
+                    # response=True makes the write wait for the peripheral's ack
+                    with span("ble_write", command=command, attempt=attempt + 1):
+                        await client.write_gatt_char(self.char_uuid, command.encode(), response=True)
+                    return True
+                except Exception as e:
+                    print(f"[BLE Error] {e}")
+                    event("ble_write_retry", command=command, attempt=attempt + 1, error=str(e))
+                    await self._drop_client()
+                    if attempt == 1:
+                        raise
+
+    async def _disconnect(self):
+        async with self._lock:
+            client, self.client = self.client, None
+            if client is not None:
+                await client.disconnect()
+
+    # --------------------- Thread-safe API ---------------------
+
+    def send(self, command, timeout=None):
+        # Blocks the calling thread until the write is acknowledged; safe from any thread.
+        # Returns the round-trip time in seconds, or None if the write failed.
+        if timeout is None:
+            timeout = self.write_timeout + self.max_backoff * self.max_attempts
+        start = time.perf_counter()
+        try:
+            self._submit(self._send(command)).result(timeout)
+        except Exception as e:
+            print(f"[BLE Error] Failed to send '{command}': {e}")
+            return None
+        latency = time.perf_counter() - start
+        self.latencies.append(latency)
+        return latency
+
+    def connect_async(self):
+        future = self._submit(self._ensure_connected())
+        future.add_done_callback(lambda f: f.exception())  # connection errors are already logged
+        return future
+
+    def is_connected(self):
+        client = self.client
+        if client is None:
+            return False
+        try:
+            return self._submit(_is_connected(client)).result(1.0)
+        except Exception:
+            return False
+
+    def latency_summary(self):
+        if not self.latencies:
+            return {"count": 0}
+        lat = np.array(self.latencies) * 1000.0
+        return {
+            "count": len(lat),
+            "mean_ms": float(lat.mean()),
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p95_ms": float(np.percentile(lat, 95)),
+            "max_ms": float(lat.max()),
+        }
+
+    def close(self):
+        try:
+            self._submit(self._disconnect()).result(self.write_timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1.0)
+
+
+# --------------------- Latency comparison ---------------------
+
+async def _send_with_new_client(client_factory, address, char_uuid, command):
+    # The previous behaviour: connect, write, disconnect for every command
+    async with client_factory(address) as client:
+        await client.write_gatt_char(char_uuid, command.encode(), response=True)
+
+
+def compare_latency(client_factory, address, char_uuid, n=20):
+    # Failed sends are counted rather than timed; either side may have no successes
+    per_command, per_command_failed = [], 0
+    for i in range(n):
+        start = time.perf_counter()
+        try:
+            asyncio.run(_send_with_new_client(client_factory, address, char_uuid, str(i % 5)))
+        except Exception as e:
+            print(f"[BLE Error] Failed to send '{i % 5}': {e}")
+            per_command_failed += 1
+            continue
+        per_command.append(time.perf_counter() - start)
+
+    session = BleSession(address, char_uuid, client_factory=client_factory)
+    failed = sum(session.send(str(i % 5)) is None for i in range(n))
+    summary = session.latency_summary()
+    summary["failed"] = failed
+    session.close()
+
+    per_command = np.array(per_command) * 1000.0
+    if len(per_command):
+        print(f"[INFO] Connect per command: mean {per_command.mean():.1f} ms, "
+              f"p95 {np.percentile(per_command, 95):.1f} ms ({per_command_failed} of {n} sends failed)")
+    else:
+        print(f"[ERROR] Connect per command: all {n} sends failed")
+    if summary["count"]:
+        print(f"[INFO] Persistent session:  mean {summary['mean_ms']:.1f} ms, "
+              f"p95 {summary['p95_ms']:.1f} ms ({failed} of {n} sends failed)")
+    else:
+        print(f"[ERROR] Persistent session: all {n} sends failed")
+    return per_command, summary
+
+
+if __name__ == "__main__":
+    from standins import FakeBleakClient
+    compare_latency(FakeBleakClient, "00:00:00:00:00:00", "6e400002-b5a3-f393-e0a9-e50e24dcca9e")
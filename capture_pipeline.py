@@ -0,0 +1,257 @@
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import numpy as np
+
+from tracing import event, latency_stats, span
+
+# Runs the per-sample survey stages as a dependency graph so independent work overlaps:
+# the photo download runs alongside the beam sweep, and saving sample N runs while the
+# robot is already moving to sample N+1.
+
+
+class StageFailed(Exception):
+    pass
+
+
+class Stage:
+    # deps are stages of the same sample; prev_deps are stages of the previous sample
+    def __init__(self, name, fn, deps=(), prev_deps=(), retries=2, backoff=0.2, abort_on_failure=False):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.prev_deps = tuple(prev_deps)
+        self.retries = retries
+        self.backoff = backoff
+        self.abort_on_failure = abort_on_failure
+
+
+class SampleContext:
+    def __init__(self, index):
+        self.index = index
+        self.started = None
+        self.results = {}
+        self.failed = {}
+        self.attempts = {}
+        self.timings = {}
+
+    @property
+    def ok(self):
+        return not self.failed
+
+
+class CapturePipeline:
+
+    def __init__(self, stages, max_workers=4, max_inflight=2, on_sample=None):
+        names = [stage.name for stage in stages]
+        for stage in stages:
+            unknown = set(stage.deps + stage.prev_deps) - set(names)
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages {sorted(unknown)}")
+            if any(names.index(dep) >= names.index(stage.name) for dep in stage.deps):
+                raise ValueError(f"Stage '{stage.name}' must come after the stages it depends on")
+        self.stages = stages
+        self.max_workers = max_workers
+        self.max_inflight = max_inflight  # samples allowed to be in progress at once
+        self.on_sample = on_sample
+        self.durations = defaultdict(list)
+        self.samples = []
+        self.elapsed = 0.0
+
+    def _run_stage(self, stage, ctx):
+        for attempt in range(stage.retries + 1):
+            ctx.attempts[stage.name] = attempt + 1
+            start = time.perf_counter()
+            try:
+                with span(stage.name, sample=ctx.index, attempt=attempt + 1):
+                    result = stage.fn(ctx)
+            except Exception as e:
+                print(f"[WARN] Sample {ctx.index} stage '{stage.name}' attempt {attempt + 1} failed: {e}")
+                event("stage_retry" if attempt < stage.retries else "stage_failed",
+                      stage=stage.name, sample=ctx.index, attempt=attempt + 1, error=str(e))
+                if attempt == stage.retries:
+                    raise StageFailed(f"Stage '{stage.name}' failed after {attempt + 1} attempts: {e}") from e
+                time.sleep(stage.backoff * 2 ** attempt)
+                continue
+            ctx.timings[stage.name] = time.perf_counter() - start
+            return result
+
+    def run(self, n_samples):
+        self.samples = [SampleContext(i) for i in range(n_samples)]
+        pending = [(i, stage) for i in range(n_samples) for stage in self.stages]
+        done = set()
+        running = {}
+        remaining = [len(self.stages)] * n_samples
+        floor = 0  # oldest sample that still has unfinished stages
+        aborted = None
+        start = time.perf_counter()
+
+        def finish(i, name):
+            nonlocal floor
+            done.add((i, name))
+            remaining[i] -= 1
+            if remaining[i] == 0:
+                ctx = self.samples[i]
+                for stage_name, seconds in ctx.timings.items():
+                    self.durations[stage_name].append(seconds)
+                if self.on_sample is not None:
+                    self.on_sample(ctx, self)
+            while floor < n_samples and remaining[floor] == 0:
+                floor += 1
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="capture") as pool:
+            while pending or running:
+                progressed = False
+                if aborted is None:
+                    for task in list(pending):
+                        i, stage = task
+                        if i >= floor + self.max_inflight:
+                            break
+                        if not all((i, dep) in done for dep in stage.deps):
+                            continue
+                        if i > 0 and not all((i - 1, dep) in done for dep in stage.prev_deps):
+                            continue
+                        pending.remove(task)
+                        ctx = self.samples[i]
+                        if any(dep in ctx.failed for dep in stage.deps):
+                            ctx.failed[stage.name] = "skipped"
+                            finish(i, stage.name)
+                            progressed = True
+                            continue
+                        if ctx.started is None:
+                            ctx.started = datetime.now()
+                        running[pool.submit(self._run_stage, stage, ctx)] = task
+                if progressed:
+                    continue
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i, stage = running.pop(future)
+                    ctx = self.samples[i]
+                    try:
+                        ctx.results[stage.name] = future.result()
+                    except Exception as e:
+                        ctx.failed[stage.name] = str(e)
+                        if not isinstance(e, StageFailed):
+                            traceback.print_exc()
+                        if stage.abort_on_failure and aborted is None:
+                            aborted = (i, e)
+                    finish(i, stage.name)
+
+        self.elapsed = time.perf_counter() - start
+        if aborted is not None:
+            i, e = aborted
+            raise StageFailed(f"Survey aborted at sample {i}: {e}") from e
+        return self.summary()
+
+    @property
+    def completed(self):
+        return sum(1 for ctx in self.samples if ctx.started is not None and ctx.ok
+                   and len(ctx.results) == len(self.stages))
+
+    def samples_per_minute(self, elapsed=None):
+        elapsed = self.elapsed if elapsed is None else elapsed
+        return 60.0 * self.completed / elapsed if elapsed > 0 else 0.0
+
+    def bottleneck(self, window=20):
+        # Stage with the highest mean duration over the last `window` samples, and that mean in s
+        means = {name: float(np.mean(values[-window:])) for name, values in self.durations.items() if values}
+        if not means:
+            return None
+        name = max(means, key=means.get)
+        return name, means[name]
+
+    def summary(self):
+        stages = {name: latency_stats(values) for name, values in self.durations.items()}
+        return {
+            "samples": len(self.samples),
+            "completed": self.completed,
+            "failed": sum(1 for ctx in self.samples if ctx.failed),
+            "elapsed_s": self.elapsed,
+            "samples_per_min": self.samples_per_minute(),
+            "stages": stages,
+        }
+
+
+def survey_stages(move_to, fetch_photo, sweep, persist, retries=2, plan=None):
+    # Stage graph for one survey sample. The robot only moves once the previous sample's
+    # photo and sweep are done; persisting is off the critical path. A model-guided sweep
+    # gets a plan stage between the photo and the sweep, so it can no longer overlap with
+    # the photo, and a retried sweep reuses the plan instead of asking the model again.
+    stages = [
+        Stage("motion", move_to, prev_deps=("photo", "sweep"), retries=0, abort_on_failure=True),
+        Stage("photo", fetch_photo, deps=("motion",), retries=retries),
+    ]
+    if plan is not None:
+        stages.append(Stage("plan", plan, deps=("photo",), retries=retries))
+    return stages + [
+        Stage("sweep", sweep, deps=("motion", "plan") if plan is not None else ("motion",), retries=retries),
+        Stage("persist", persist, deps=("photo", "sweep"), retries=retries),
+    ]
+
+
+def print_summary(summary, title="Survey"):
+    print(f"[INFO] {title}: {summary['completed']}/{summary['samples']} samples in "
+          f"{summary['elapsed_s']:.1f} s ({summary['samples_per_min']:.1f} samples/min)")
+    for name, stats in summary["stages"].items():
+        print(f"[INFO]   {name:<8} mean {stats['mean_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms")
+
+
+# --------------------- Stand-in demo ---------------------
+
+def run_with_standins(n_samples=10, max_workers=4, motion_time=0.8, save_dir=None):
+    import tempfile
+    from pathlib import Path
+
+    from ble_session import BleSession
+    from photo_client import PhotoClient
+    from shards import ShardWriter
+    from standins import FakeBleakClient, FakeCameraServer, FakePowerService
+
+    save_dir = Path(save_dir or tempfile.mkdtemp(prefix="survey_"))
+    camera = FakeCameraServer().start()
+    ble = BleSession("00:00:00:00:00:00", "6e400002-b5a3-f393-e0a9-e50e24dcca9e",
+                     client_factory=FakeBleakClient)
+    power = FakePowerService()
+    photos = PhotoClient(camera.url)
+    dataset = ShardWriter(save_dir / "shards", ("0", "1", "3", "4"))
+
+    def move_to(ctx):
+        if ctx.index > 0:
+            time.sleep(motion_time)
+
+    def fetch_photo(ctx):
+        return photos.take_photo().data
+
+    def sweep(ctx):
+        powers = []
+        for beam in ("0", "1", "3", "4"):
+            if ble.send(beam) is None:
+                raise RuntimeError(f"BLE switch to beam {beam} failed")
+            powers.append(power.measure().power)
+        return powers
+
+    def persist(ctx):
+        dataset.append(ctx.results["photo"], ctx.results["sweep"], timestamp=ctx.started.timestamp(),
+                       name=ctx.started.strftime("%Y%m%d_%H%M%S_%f"), col=ctx.index)
+
+    try:
+        sequential = CapturePipeline(survey_stages(move_to, fetch_photo, sweep, persist), max_workers=1)
+        print_summary(sequential.run(n_samples), "Sequential")
+        pipelined = CapturePipeline(survey_stages(move_to, fetch_photo, sweep, persist), max_workers=max_workers)
+        summary = pipelined.run(n_samples)
+        print_summary(summary, "Pipelined")
+    finally:
+        dataset.close()
+        ble.close()
+        camera.stop()
+    return summary
+
+
+if __name__ == "__main__":
+    run_with_standins()
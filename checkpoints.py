@@ -0,0 +1,159 @@
+import os
+import queue
+import random
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+import torch
+
+# Full training checkpoints (model, optimizer, scheduler, RNG state, epoch and the
+# trainer's own bookkeeping) written on a background thread. The training thread only
+# pays for copying the state to CPU memory. Keeps the last N epochs plus the best one.
+
+EPOCH_PATTERN = re.compile(r"epoch-(\d+)\.pt$")
+
+
+def _to_cpu(obj):
+    # Detached copies, so training can keep updating the live tensors during the write
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: _to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(value) for value in obj)
+    return obj
+
+
+def rng_state():
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class CheckpointManager:
+
+    def __init__(self, directory, keep_last=3, best_weights_path=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep_last = keep_last
+        # Plain state_dict of the best model, the file Validation.ipynb and inference.py load
+        self.best_weights_path = best_weights_path
+        self._queue = queue.Queue(maxsize=2)  # bounds memory if the disk falls behind
+        self._error = None
+        self._thread = threading.Thread(target=self._writer, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, epoch, model, optimizer, scheduler, is_best=False, trainer_state=None):
+        # epoch is the number of completed epochs; resuming starts at this epoch index
+        if self._error is not None:
+            raise RuntimeError(f"Checkpoint writer failed: {self._error}") from self._error
+        snapshot = {
+            "epoch": epoch,
+            "model": _to_cpu(model.state_dict()),
+            "optimizer": _to_cpu(optimizer.state_dict()),
+            "scheduler": scheduler.state_dict(),
+            "rng": rng_state(),
+            "trainer": trainer_state or {},
+        }
+        self._queue.put((snapshot, is_best))
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                snapshot, is_best = item
+                path = self.directory / f"epoch-{snapshot['epoch']:04d}.pt"
+                self._atomic_save(snapshot, path)
+                if is_best:
+                    self._atomic_save(snapshot, self.directory / "best.pt")
+                    if self.best_weights_path is not None:
+                        self._atomic_save(snapshot["model"], Path(self.best_weights_path))
+                self._prune()
+            except Exception as e:
+                print(f"[ERROR] Checkpoint write failed: {e}")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _atomic_save(obj, path):
+        tmp = path.with_name(path.name + ".tmp")
+        torch.save(obj, tmp)
+        os.replace(tmp, path)
+
+    def epochs(self):
+        found = []
+        for path in self.directory.iterdir():
+            match = EPOCH_PATTERN.match(path.name)
+            if match:
+                found.append((int(match.group(1)), path))
+        return sorted(found)
+
+    def _prune(self):
+        for _, path in self.epochs()[:-self.keep_last]:
+            path.unlink()
+
+    def latest(self):
+        found = self.epochs()
+        return found[-1][1] if found else None
+
+    def restore(self, model, optimizer, scheduler, path=None):
+        # Loads the latest (or given) checkpoint into the objects and returns it, or None
+        # when there is nothing to resume
+        self.wait()
+        path = path or self.latest()
+        if path is None:
+            return None
+        checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        scheduler.load_state_dict(checkpoint["scheduler"])
+        set_rng_state(checkpoint["rng"])
+        print(f"[INFO] Resumed from {path} (epoch {checkpoint['epoch']})")
+        return checkpoint
+
+    def wait(self):
+        self._queue.join()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+
+
+class EarlyStopping:
+    # Stops once the monitored value (higher is better) has not improved by more than
+    # min_delta for `patience` epochs
+
+    def __init__(self, patience=5, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = -float("inf")
+        self.stale = 0
+
+    def step(self, value):
+        if value > self.best + self.min_delta:
+            self.best = value
+            self.stale = 0
+        else:
+            self.stale += 1
+        return self.stale >= self.patience
+
+    def state_dict(self):
+        return {"best": self.best, "stale": self.stale}
+
+    def load_state_dict(self, state):
+        self.best, self.stale = state["best"], state["stale"]
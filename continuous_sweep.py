@@ -0,0 +1,147 @@
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from powerchain import PowerMeasurement, block_means, settled_tail
+from tracing import span
+
+# Beam sweep from one uninterrupted power stream. The capture loop marks each beam
+# switch with the stream's sample index just before the BLE write and again once it is
+# acknowledged; after the last beam the stream is cut into one window per beam:
+#
+#   ... | before_i | switching | after_i | guard | beam i window | guard | before_i+1 | ...
+#
+# Each window's power is the mean of its stable tail (settled_tail), so samples still
+# in flight from before the switch are dropped even when the marker lags the stream.
+# The markers come from the sink, which lags the radio by the USRP and flowgraph
+# latency; measure_latency finds it from a beam step once, and the sweep adds it to the
+# guard and the dwell so each window starts after its switch has reached the stream.
+#
+# `stream` is anything with the power stream's samp_rate and vlen, sample_index() (index
+# of the sample arriving now) and read(start, stop, timeout) (power samples in
+# [start, stop), waiting for them):
+# signalpow.power_vector_sink, or standins.FakePowerStream.
+
+SwitchMarker = namedtuple("SwitchMarker", ["beam", "before", "after", "before_ms", "after_ms"])
+
+UNCALIBRATED_LATENCY_MS = 20.0  # assumed when the latency could not be measured
+
+
+def measure_latency(stream, switch, beams, hold_ms=100.0, min_step_db=3.0, timeout=1.0):
+    # Lag (ms) from sample_index() at an acknowledged beam switch to the level step
+    # showing up in the stream. Steps through `beams` with switch(beam), holding each
+    # for hold_ms, and returns the largest lag over the steps of at least min_step_db
+    # (None if no two neighbouring beams differ that much). Lags up to hold_ms / 2 can
+    # be measured.
+    rate = stream.samp_rate
+    hold = int(hold_ms * rate / 1000.0)
+    block = max(1, stream.vlen // 16)
+    markers = []
+    for beam in beams:
+        before = stream.sample_index()
+        switch(beam)
+        markers.append((before, stream.sample_index()))
+        time.sleep(hold_ms / 1000.0)
+    start, stop = markers[0][1], markers[-1][1] + hold
+    blocks = block_means(stream.read(start, stop, timeout), block)
+
+    def level(first, last):
+        segment = blocks[(first - start) // block:(last - start) // block]
+        return float(np.median(segment)) if len(segment) else math.nan
+
+    lags = []
+    for i in range(1, len(markers)):
+        before, after = markers[i]
+        end = markers[i + 1][0] if i + 1 < len(markers) else stop
+        old = level(markers[i - 1][1] + hold // 2, before)
+        new = level(after + hold // 2, end)
+        if not abs(new - old) >= min_step_db:
+            continue
+        # First block past the midpoint between the two levels
+        first = (before - start) // block
+        crossed = np.nonzero((blocks[first:(end - start) // block] - (old + new) / 2) * np.sign(new - old) > 0)[0]
+        if len(crossed):
+            lags.append(1000.0 * (start + (first + crossed[0]) * block - after) / rate)
+    return max(0.0, max(lags)) if lags else None
+
+
+def calibrate_latency(stream, switch, beams, **kwargs):
+    # measure_latency, falling back to UNCALIBRATED_LATENCY_MS when there is no usable step
+    latency = measure_latency(stream, switch, beams, **kwargs)
+    if latency is None:
+        print(f"[WARN] No beam step large enough to measure the stream latency, "
+              f"assuming {UNCALIBRATED_LATENCY_MS:.0f} ms")
+        return UNCALIBRATED_LATENCY_MS
+    print(f"[INFO] Stream latency {latency:.1f} ms")
+    return latency
+
+
+class ContinuousSweep:
+
+    def __init__(self, stream, guard_after_ms=2.0, guard_before_ms=0.5, dwell_ms=8.0, block=None, window=4,
+                 ci_db=0.25, confidence=0.95, latency_ms=UNCALIBRATED_LATENCY_MS):
+        # latency_ms: stream latency behind the markers, from measure_latency
+        self.stream = stream
+        self.samp_rate = stream.samp_rate
+        block = block or stream.vlen // 4  # about 1 ms at either chain's rate
+        self.latency_ms = latency_ms
+        self.guard_after = int((latency_ms + guard_after_ms) * self.samp_rate / 1000.0)
+        self.guard_before = int(guard_before_ms * self.samp_rate / 1000.0)
+        # Beam hold time after the ack: the latency, then at least `window` blocks of
+        # stable power
+        self.dwell_ms = latency_ms + max(dwell_ms, 1000.0 * window * block / self.samp_rate)
+        self.block = block
+        self.window = window
+        self.ci_db = ci_db
+        self.confidence = confidence
+        self.markers = []
+        self._pending = None
+
+    def before_switch(self, beam):
+        # Call right before the BLE write: the previous beam's window ends here
+        self._pending = (self.stream.sample_index(), time.time() * 1000.0)
+
+    def after_switch(self, beam):
+        # Call once the write is acknowledged; holds the beam for dwell_ms
+        before, before_ms = self._pending or (self.stream.sample_index(), time.time() * 1000.0)
+        self._pending = None
+        self.markers.append(SwitchMarker(beam, before, self.stream.sample_index(), before_ms, time.time() * 1000.0))
+        time.sleep(self.dwell_ms / 1000.0)
+
+    def windows(self):
+        # (marker, start, stop) sample range per beam
+        dwell = int(self.dwell_ms * self.samp_rate / 1000.0)
+        result = []
+        for i, marker in enumerate(self.markers):
+            start = marker.after + self.guard_after
+            if i + 1 < len(self.markers):
+                stop = self.markers[i + 1].before - self.guard_before
+            else:
+                stop = marker.after + dwell
+            result.append((marker, start, max(start, stop)))
+        return result
+
+    def finish(self, timeout=1.0):
+        # Power per beam, as PowerMeasurements keyed by beam; settle_ms is the time from
+        # the acknowledged switch to the start of the stable part of the window
+        results = {}
+        with span("sweep_segment", beams=len(self.markers)):
+            for marker, start, stop in self.windows():
+                samples = self.stream.read(start, stop, timeout)
+                result = settled_tail(block_means(samples, self.block), self.window, self.ci_db, self.confidence)
+                if result is None:
+                    print(f"[WARN] Beam {marker.beam}: window of {1000.0 * len(samples) / self.samp_rate:.1f} ms "
+                          f"is too short to measure")
+                    results[marker.beam] = PowerMeasurement(math.nan, samples, marker.before_ms, marker.after_ms,
+                                                            marker.after_ms, None, None, False)
+                    continue
+                first = start + result.start * self.block
+                settle_ms = 1000.0 * (first - marker.after) / self.samp_rate
+                results[marker.beam] = PowerMeasurement(
+                    power=result.power, vectors=samples, requested_ms=marker.before_ms,
+                    start_ms=marker.after_ms + settle_ms,
+                    end_ms=marker.after_ms + 1000.0 * (start + result.end * self.block - marker.after) / self.samp_rate,
+                    settle_ms=settle_ms, ci_db=result.ci_db, settled=result.settled)
+        return results
@@ -0,0 +1,155 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, RandomSampler
+
+from image_cache import normalize_batch
+
+# Dataset and DataLoader factory shared by VIT.ipynb and Validation.ipynb. The dataset
+# lives in a module rather than the notebook so worker processes can import it under
+# the "spawn" start method (Windows, macOS), where classes defined in a notebook's
+# __main__ cannot be unpickled.
+
+
+class ImageArrayDataset(Dataset):
+    def __init__(self, samples, transform=None, cache=None):
+        self.samples = samples
+        self.transform = transform
+        self.labels = np.array([sample.label for sample in samples], dtype=np.int64)
+        # With an ImageCache, items are uint8 HWC array views into the cache and
+        # normalize_batch (as collate_fn) does ToTensor + Normalize per batch. Workers
+        # each map the same cache file, so the pixels are shared through the page cache.
+        # Labels always come from the samples, so re-labelled data needs no rebuild.
+        self.cache = cache
+        self.rows = cache.rows_for(samples) if cache is not None else None
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        if self.cache is not None:
+            row = self.rows[idx]
+            return self.cache.images[row], int(self.labels[idx])
+        # Shard samples read from the memory-mapped shard; folder samples carry the label
+        # precomputed by the manifest, so no .npy is loaded here
+        sample = self.samples[idx]
+        try:
+            image = sample.open_image().convert('RGB')
+        except Exception as e:
+            raise RuntimeError(f"Failed to open image {sample}: {e}")
+        if self.transform:
+            image = self.transform(image)
+        return image, int(self.labels[idx])
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_workers(cached):
+    # Leave one core for the training loop. Cached batches only need a copy and a
+    # normalise, so a few workers keep up; JPEG decoding scales with every core.
+    cpus = available_cpus()
+    if cpus <= 2:
+        return 0
+    return min(cpus - 1, 4 if cached else 32)
+
+
+def _init_worker(worker_id):
+    # Parallelism comes from the worker processes; intra-op threads would oversubscribe
+    torch.set_num_threads(1)
+
+
+def make_loader(dataset, batch_size=16, shuffle=False, device=None, num_workers=None,
+                prefetch_factor=None, persistent_workers=True, pin_memory=None):
+    # None means auto: workers from the CPU count, pinned memory only when feeding a GPU
+    cached = getattr(dataset, "cache", None) is not None
+    if num_workers is None:
+        num_workers = default_workers(cached)
+    if pin_memory is None:
+        pin_memory = device is not None and torch.device(device).type == "cuda"
+    sampler = None
+    if shuffle:
+        # The shuffle order gets its own generator (seeded from the global RNG) so a
+        # checkpoint can save it and a resumed run sees the same order; starting worker
+        # processes draws from the global RNG and would otherwise shift it.
+        generator = torch.Generator()
+        generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+        sampler = RandomSampler(dataset, generator=generator)
+    # Every new iterator draws its workers' base seed from the loader's generator; with
+    # the default (the global RNG) starting an epoch would shift the RNG that dropout and
+    # drop_path use, so a resumed run would diverge. train() reseeds it per epoch.
+    worker_rng = torch.Generator()
+    worker_rng.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+    options = dict(batch_size=batch_size, sampler=sampler, num_workers=num_workers, pin_memory=pin_memory,
+                   collate_fn=normalize_batch if cached else None, generator=worker_rng)
+    if num_workers > 0:
+        options.update(prefetch_factor=prefetch_factor or (2 if cached else 4),
+                       persistent_workers=persistent_workers, worker_init_fn=_init_worker)
+    return DataLoader(dataset, **options)
+
+
+def probe_throughput(dataset, configs=None, batch_size=16, batches=50):
+    # Images/s for each loader configuration. The first batch (worker start-up) is not
+    # counted. configs are make_loader keyword dicts.
+    if configs is None:
+        cpus = available_cpus()
+        workers = sorted({0, *[n for n in (2, 4, 8, 16, 32) if n < cpus], default_workers(dataset.cache is not None)})
+        configs = [{"num_workers": n} for n in workers]
+
+    results = []
+    for config in configs:
+        loader = make_loader(dataset, batch_size=batch_size, shuffle=True, **config)
+        it = iter(loader)
+        next(it)
+        images = 0
+        start = time.perf_counter()
+        for _ in range(batches):
+            try:
+                batch, _ = next(it)
+            except StopIteration:
+                it = iter(loader)
+                batch, _ = next(it)
+            images += batch.shape[0]
+        rate = images / (time.perf_counter() - start)
+        del it, loader
+        results.append((config, rate))
+        print(f"[INFO] {config}: {rate:8.1f} images/s")
+    return results
+
+
+if __name__ == "__main__":
+    from torchvision import transforms
+
+    from image_cache import build_cache
+    from manifest import scan_folder
+    from shards import ShardReader, find_shards
+
+    parser = argparse.ArgumentParser(description="Measure DataLoader throughput on dataset folders")
+    parser.add_argument("folders", nargs="+")
+    parser.add_argument("--cache-dir", help="also probe the decoded-image cache")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--batches", type=int, default=50)
+    args = parser.parse_args()
+
+    samples = []
+    for folder in args.folders:
+        shard_dir = find_shards(folder)
+        samples.extend(ShardReader(shard_dir).samples() if shard_dir else scan_folder(folder).samples())
+    transform = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+    print(f"[INFO] {len(samples)} samples, {available_cpus()} CPUs")
+    print("[INFO] Decoding JPEGs:")
+    probe_throughput(ImageArrayDataset(samples, transform), batch_size=args.batch_size, batches=args.batches)
+    if args.cache_dir:
+        print("[INFO] From the image cache:")
+        cache = build_cache(samples, args.cache_dir)
+        probe_throughput(ImageArrayDataset(samples, cache=cache), batch_size=args.batch_size, batches=args.batches)
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from shards import CLASS_BEAMS
+
+# Model-guided beam sweep: the beam predictor looks at the photo just taken and only the
+# top-k predicted beams are measured. Low-confidence predictions fall back to a full
+# sweep, and every audit_every-th sample is swept fully anyway so the online accuracy
+# is measured on an unbiased sample. Beams that were not measured are stored as NaN;
+# such partial sweeps are left out of training (ShardReader/Manifest .samples()), since
+# their strongest beam is one the model picked.
+
+GUIDED, FULL, AUDIT = "guided", "full", "audit"
+
+SweepPlan = namedtuple("SweepPlan", ["beams", "probs", "mode", "inference_ms"])
+
+
+class GuidedSweep:
+
+    def __init__(self, predictor, beams, top_k=2, min_confidence=0.6, audit_every=25, log_path=None,
+                 class_beams=CLASS_BEAMS):
+        # class_beams[i] is the beam the model's class i stands for, as in the training labels
+        self.predictor = predictor
+        self.beams = list(beams)
+        unknown = [beam for beam in self.beams if beam not in class_beams]
+        if unknown:
+            raise ValueError(f"Beams {unknown} have no model class (classes are beams {list(class_beams)})")
+        self.classes = [list(class_beams).index(beam) for beam in self.beams]
+        self.top_k = top_k
+        self.min_confidence = min_confidence
+        self.audit_every = audit_every
+        self.log_path = Path(log_path) if log_path is not None else None
+        self._lock = threading.Lock()
+        self.count = 0
+        self.modes = {GUIDED: 0, FULL: 0, AUDIT: 0}
+        self.checked = {GUIDED: [0, 0], FULL: [0, 0], AUDIT: [0, 0]}  # [correct, total]
+        self.topk_hits = [0, 0]  # full/audit sweeps where the best beam was in the top-k
+
+    def plan(self, jpeg):
+        # Beams to measure (most likely first), class probabilities and sweep mode
+        start = time.perf_counter()
+        # Probabilities of this survey's beams, in self.beams order; other classes cannot be
+        # measured, so renormalise without them
+        probs = self.predictor.predict_jpegs([jpeg])[0]
+        if len(probs) <= max(self.classes):
+            raise ValueError(f"Model has {len(probs)} classes, the beams need class {max(self.classes)}")
+        probs = probs[self.classes]
+        probs = probs / probs.sum()
+        order = np.argsort(probs)[::-1]
+        with self._lock:
+            self.count += 1
+            if self.audit_every and self.count % self.audit_every == 0:
+                mode = AUDIT
+            elif probs[order[:self.top_k]].sum() < self.min_confidence:
+                mode = FULL
+            else:
+                mode = GUIDED
+            self.modes[mode] += 1
+        chosen = order if mode != GUIDED else order[:self.top_k]
+        return SweepPlan([self.beams[i] for i in chosen], probs, mode, (time.perf_counter() - start) * 1000.0)
+
+    def record(self, plan, powers, name=""):
+        # powers is aligned with self.beams, NaN for beams that were skipped. On guided
+        # sweeps "correct" means the predicted beam was the best of those measured; on
+        # full and audit sweeps it is checked against every beam.
+        probs, mode = plan.probs, plan.mode
+        powers = np.asarray(powers, dtype=np.float64)
+        predicted = int(np.argmax(probs))
+        best = int(np.nanargmax(powers))
+        correct = predicted == best
+        with self._lock:
+            self.checked[mode][0] += correct
+            self.checked[mode][1] += 1
+            topk_hit = None
+            if mode != GUIDED:
+                topk_hit = bool(best in np.argsort(probs)[::-1][:self.top_k])
+                self.topk_hits[0] += topk_hit
+                self.topk_hits[1] += 1
+            if self.log_path is not None:
+                entry = {
+                    "time": time.time(), "name": name, "mode": mode,
+                    "predicted": self.beams[predicted], "confidence": float(probs[predicted]),
+                    "best": self.beams[best], "correct": bool(correct), "topk_hit": topk_hit,
+                    "measured": [b for b, p in zip(self.beams, powers) if not np.isnan(p)],
+                    "inference_ms": round(plan.inference_ms, 1),
+                }
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+        print(f"[INFO] {mode} sweep: predicted beam {self.beams[predicted]} ({probs[predicted]:.2f}), "
+              f"best measured {self.beams[best]} -> {'right' if correct else 'wrong'}")
+        return correct
+
+    def summary(self):
+        with self._lock:
+            def rate(correct, total):
+                return correct / total if total else None
+            measured = sum(self.modes[m] * (len(self.beams) if m != GUIDED else self.top_k) for m in self.modes)
+            return {
+                "samples": self.count,
+                "modes": dict(self.modes),
+                "audit_accuracy": rate(*self.checked[AUDIT]),
+                "full_accuracy": rate(*self.checked[FULL]),
+                "guided_consistency": rate(*self.checked[GUIDED]),
+                "topk_recall": rate(*self.topk_hits),
+                "beams_per_sample": measured / self.count if self.count else None,
+            }
+
+    def status(self):
+        s = self.summary()
+        audit = f"{s['audit_accuracy'] * 100:.0f}%" if s["audit_accuracy"] is not None else "n/a"
+        per_sample = f"{s['beams_per_sample']:.1f}" if s["beams_per_sample"] is not None else "n/a"
+        return f"model acc {audit} (audits {s['modes'][AUDIT]}), {per_sample} beams/sample"
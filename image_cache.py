@@ -0,0 +1,278 @@
+import hashlib
+import io
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from shards import ShardSample
+
+# Decodes and resizes every training image once into a uint8 N x 224 x 224 x 3 memmap.
+# Epochs and folds then read pixels straight from the page cache and normalise whole
+# batches at once, instead of running JPEG decode + resize per image per epoch.
+#
+# Rows are keyed by each image's content hash, so the cache survives moving or
+# re-labelling the dataset and new samples are appended without touching the rest.
+# The hash of each source is remembered with its size and mtime, so sources that have
+# not changed are not read again on the next build.
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+CACHE_VERSION = 2
+INDEX_NAME = "index.json"
+
+
+def source_id(sample):
+    # Where the encoded image lives now, and that file's (size, mtime) to tell if it changed
+    if isinstance(sample, ShardSample):
+        path = sample.reader.shard_path(sample.index)
+        source = f"{path}#{int(sample.reader.columns['image_offset'][sample.index])}"
+    else:
+        path = sample[0]
+        source = str(path)
+    stat = os.stat(path)
+    return source, [stat.st_size, stat.st_mtime_ns]
+
+
+def read_source(sample):
+    if isinstance(sample, ShardSample):
+        return bytes(sample.reader.image_bytes(sample.index))
+    return Path(sample[0]).read_bytes()
+
+
+def sample_label(sample):
+    # ShardSample and manifest.FileSample both carry their label
+    return sample.label
+
+
+def sample_digest(sample):
+    # Content hash of the encoded image
+    return hashlib.blake2b(read_source(sample), digest_size=16).digest()
+
+
+def decode_resized(data, size=(224, 224), resample=Image.BILINEAR):
+    # Same pixels as transforms.Resize(size) on the PIL image. size is (height, width)
+    # like torchvision; PIL wants (width, height).
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    return np.asarray(image.resize((size[1], size[0]), resample))
+
+
+class ImageCache:
+
+    def __init__(self, directory, size=(224, 224), resample=Image.BILINEAR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.size = tuple(size)
+        self.resample = int(resample)
+        self.index_path = self.directory / INDEX_NAME
+        self.data_path = self.directory / "images.u8"
+        index = {}
+        if self.index_path.exists():
+            index = json.loads(self.index_path.read_text())
+            if (index.get("version") != CACHE_VERSION or tuple(index["size"]) != self.size
+                    or index["resample"] != self.resample):
+                raise ValueError(f"{self.directory} holds a different cache layout; use another directory")
+        self.digests = index.get("digests", [])
+        self.sources = index.get("sources", {})  # source id -> [size, mtime, digest]
+        self.rows = {digest: i for i, digest in enumerate(self.digests)}
+        self._dirty = False  # sources hashed since the index was saved
+        self._images = None
+
+    @property
+    def row_shape(self):
+        return (self.size[0], self.size[1], 3)
+
+    @property
+    def images(self):
+        # Opened lazily (and dropped when pickled) so DataLoader workers map the file
+        # themselves instead of receiving a copy
+        if self._images is None:
+            if not self.digests:
+                return np.zeros((0,) + self.row_shape, dtype=np.uint8)
+            self._images = np.memmap(self.data_path, dtype=np.uint8, mode="r",
+                                     shape=(len(self.digests),) + self.row_shape)
+        return self._images
+
+    def __len__(self):
+        return len(self.digests)
+
+    def digest(self, sample):
+        # Hex content hash, read from the source only if it is new or has changed
+        source, stat = source_id(sample)
+        known = self.sources.get(source)
+        if known is not None and known[:2] == stat:
+            return known[2]
+        digest = sample_digest(sample).hex()
+        self.sources[source] = stat + [digest]
+        self._dirty = True
+        return digest
+
+    def digests_for(self, samples):
+        digests = [self.digest(sample) for sample in samples]
+        if self._dirty:
+            self.save()  # read-only users (rows_for, predictions) then skip the hashing next time
+        return digests
+
+    def rows_for(self, samples):
+        rows = []
+        for sample, digest in zip(samples, self.digests_for(samples)):
+            if digest not in self.rows:
+                raise KeyError(f"{sample} is not in the image cache; run build_cache on it first")
+            rows.append(self.rows[digest])
+        return np.array(rows, dtype=np.int64)
+
+    def add(self, samples):
+        # Decodes and appends the images not cached yet; returns how many were added
+        new = {}
+        for sample in samples:
+            digest = self.digest(sample)  # the index is saved once, after the pixels
+            if digest not in self.rows and digest not in new:
+                new[digest] = sample
+        row_bytes = int(np.prod(self.row_shape))
+        if new:
+            self._images = None
+            mode = "r+b" if self.data_path.exists() else "w+b"
+            with open(self.data_path, mode) as f:
+                # Drop rows a crashed build appended but never indexed
+                f.truncate(len(self.digests) * row_bytes)
+                f.seek(0, os.SEEK_END)
+                for digest, sample in new.items():
+                    pixels = decode_resized(read_source(sample), self.size, self.resample)
+                    f.write(np.ascontiguousarray(pixels).tobytes())
+        for digest in new:
+            self.rows[digest] = len(self.digests)
+            self.digests.append(digest)
+        if self._dirty:
+            self.save()
+        return len(new)
+
+    def save(self):
+        # The index is written after the pixels: rows it lists are always complete
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp.write_text(json.dumps({"version": CACHE_VERSION, "size": list(self.size), "resample": self.resample,
+                                   "digests": self.digests, "sources": self.sources}))
+        os.replace(tmp, self.index_path)
+        self._dirty = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+
+def build_cache(samples, cache_dir, size=(224, 224), resample=Image.BILINEAR):
+    # Adds any samples not cached yet and returns the cache
+    start = time.perf_counter()
+    cache = ImageCache(Path(cache_dir) / f"images-{size[0]}x{size[1]}-{int(resample)}", size, resample)
+    added = cache.add(samples)
+    if added:
+        print(f"[INFO] Cached {added} new images ({len(cache)} total) in {time.perf_counter() - start:.1f} s "
+              f"-> {cache.data_path}")
+    return cache
+
+
+def normalize_batch(batch, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    # collate_fn for cached samples: the memmap views are gathered once into a uint8
+    # NHWC stack, then each channel is converted and normalised for the whole batch at
+    # once (same float32 values as ToTensor() + Normalize(mean, std) per image).
+    stacked = np.stack([image for image, _ in batch])
+    out = torch.empty((stacked.shape[0], 3) + stacked.shape[1:3], dtype=torch.float32)
+    if torch.utils.data.get_worker_info() is not None:
+        # Like default_collate: build the batch in shared memory so it is not copied
+        # again on its way to the main process
+        out.share_memory_()
+    images = out.numpy()
+    for c in range(3):
+        channel = images[:, c]
+        np.divide(stacked[..., c], np.float32(255.0), out=channel)
+        channel -= np.float32(mean[c])
+        channel /= np.float32(std[c])
+    labels = torch.tensor([label for _, label in batch], dtype=torch.int64)
+    return out, labels
+
+
+# --------------------- Benchmark ---------------------
+
+class _DecodeDataset(Dataset):
+    # The uncached path the notebooks use: PIL decode + Resize + ToTensor + Normalize
+    def __init__(self, samples):
+        from torchvision import transforms
+        self.samples = samples
+        self.transform = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+        ])
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        data = read_source(self.samples[idx])
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+        return self.transform(image), sample_label(self.samples[idx])
+
+
+class _CachedDataset(Dataset):
+    def __init__(self, cache, samples):
+        self.cache = cache
+        self.rows = cache.rows_for(samples)
+        self.labels = [sample_label(sample) for sample in samples]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        return self.cache.images[self.rows[idx]], self.labels[idx]
+
+
+def benchmark(samples, cache_dir, batch_size=16, epochs=2, model=None):
+    # Epoch time over the same samples with and without the cache. With a model the
+    # forward pass is included, otherwise only data loading is timed.
+    def epoch(loader):
+        start = time.perf_counter()
+        with torch.no_grad():
+            for images, _ in loader:
+                if model is not None:
+                    model(images)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache = build_cache(samples, cache_dir)
+    build_s = time.perf_counter() - start
+
+    uncached = DataLoader(_DecodeDataset(samples), batch_size=batch_size, shuffle=True)
+    cached = DataLoader(_CachedDataset(cache, samples), batch_size=batch_size, shuffle=True,
+                        collate_fn=normalize_batch)
+    results = {
+        "build_s": build_s,
+        "uncached_epoch_s": min(epoch(uncached) for _ in range(epochs)),
+        "cached_epoch_s": min(epoch(cached) for _ in range(epochs)),
+    }
+    print(f"[INFO] {len(samples)} images: cache build {build_s:.2f} s, epoch uncached "
+          f"{results['uncached_epoch_s']:.2f} s, cached {results['cached_epoch_s']:.2f} s "
+          f"({results['uncached_epoch_s'] / results['cached_epoch_s']:.1f}x)")
+    return results
+
+
+if __name__ == "__main__":
+    # Synthetic camera-sized JPEGs in a temporary folder
+    import tempfile
+
+    folder = Path(tempfile.mkdtemp(prefix="cache_bench_"))
+    rng = np.random.default_rng(0)
+    from manifest import scan_folder
+
+    base = np.asarray(Image.linear_gradient("L").resize((1280, 960)).convert("RGB"))
+    for i in range(200):
+        noise = rng.integers(0, 40, base.shape, dtype=np.uint8)
+        Image.fromarray(base + noise).save(folder / f"{i:04d}.jpg", quality=90)
+        np.save(folder / f"{i:04d}.npy", rng.normal(-60, 5, 4))
+    samples = scan_folder(folder).samples()
+    torch.set_num_threads(1)
+    benchmark(samples, folder / "cache")
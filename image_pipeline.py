@@ -0,0 +1,103 @@
+import io
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageTk
+
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)  # PIL's RGB -> L weights
+
+
+def enhance(img, contrast=1.5, brightness=1.3):
+    # ImageEnhance.Contrast(contrast) followed by ImageEnhance.Brightness(brightness),
+    # fused into one vectorised pass over the pixels
+    pixels = np.asarray(img.convert("RGB"), dtype=np.float32)
+    mean = int(float((pixels @ LUMA).mean()) + 0.5)
+    out = np.clip(mean + (pixels - mean) * contrast, 0, 255)
+    out *= brightness
+    np.clip(out, 0, 255, out=out)
+    return Image.fromarray(out.astype(np.uint8), "RGB")
+
+
+def decode_preview(raw_bytes, size=(400, 300), contrast=1.5, brightness=1.3):
+    # Decodes straight from the in-memory JPEG. draft() lets the decoder downscale by
+    # 1/2, 1/4 or 1/8 while decoding, so the full-resolution image is never built.
+    img = Image.open(io.BytesIO(raw_bytes))
+    img.draft("RGB", size)
+    img = img.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+    return enhance(img, contrast, brightness)
+
+
+class TkDispatcher:
+    # Runs callables on the Tk main thread. Worker threads queue UI updates here instead
+    # of touching widgets directly; the queue is drained from root.after().
+
+    def __init__(self, root, poll_ms=20):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.calls = queue.Queue()
+        self.root.after(self.poll_ms, self._poll)
+
+    def call(self, fn, *args, **kwargs):
+        self.calls.put((fn, args, kwargs))
+
+    def _poll(self):
+        try:
+            while True:
+                fn, args, kwargs = self.calls.get_nowait()
+                try:
+                    fn(*args, **kwargs)
+                except Exception as e:
+                    print(f"[ERROR] UI update failed: {e}")
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_ms, self._poll)
+
+
+class PreviewPipeline:
+    # Decodes previews on a small worker pool and writes files on a separate writer
+    # thread. Only the finished preview reaches Tk, where the PhotoImage is created.
+
+    def __init__(self, dispatcher, workers=2, size=(400, 300)):
+        self.dispatcher = dispatcher
+        self.size = size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self._latest = 0
+        self._lock = threading.Lock()
+
+    def show(self, raw_bytes, label_widget):
+        with self._lock:
+            self._latest += 1
+            seq = self._latest
+
+        def done(future):
+            try:
+                img = future.result()
+            except Exception as e:
+                print(f"[ERROR] Could not decode preview: {e}")
+                return
+            self.dispatcher.call(self._display, seq, img, label_widget)
+
+        self.pool.submit(decode_preview, raw_bytes, self.size).add_done_callback(done)
+
+    def _display(self, seq, img, label_widget):
+        # Tk main thread. Previews that finish out of order never replace a newer one.
+        if seq < getattr(label_widget, "preview_seq", 0):
+            return
+        tk_img = ImageTk.PhotoImage(img)
+        label_widget.config(image=tk_img)
+        label_widget.image = tk_img
+        label_widget.preview_seq = seq
+
+    def save(self, path, raw_bytes):
+        def write():
+            Path(path).write_bytes(raw_bytes)
+            return path
+        return self.writer.submit(write)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+        self.writer.shutdown(wait=True)
@@ -0,0 +1,182 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from image_cache import decode_resized, normalize_batch
+
+# CPU inference for the beam predictor outside the notebooks: export the trained ViT-tiny
+# to TorchScript or ONNX (optionally with int8 dynamic quantisation of the Linear layers)
+# and run it with a fixed batch shape and a fixed thread count.
+
+NUM_CLASSES = 5
+INPUT_SIZE = (224, 224)
+
+
+def build_model(checkpoint):
+    import timm
+    model = timm.create_model('vit_tiny_patch16_224', pretrained=False, num_classes=NUM_CLASSES)
+    model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+    model.eval()
+    return model
+
+
+def export_model(checkpoint, out_path, fmt="torchscript", quantize=False, batch_size=1):
+    # Returns the path of the exported artefact. The input shape is fixed to
+    # batch_size x 3 x 224 x 224; BeamPredictor pads partial batches to it.
+    out_path = Path(out_path)
+    model = build_model(checkpoint)
+    example = torch.zeros((batch_size, 3) + INPUT_SIZE)
+
+    if fmt == "torchscript":
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+        traced = torch.jit.freeze(traced)
+        traced.save(str(out_path))
+    elif fmt == "onnx":
+        fp32_path = out_path.with_suffix(".fp32.onnx") if quantize else out_path
+        # The TorchScript-based exporter: its graphs go through onnxruntime's quantiser
+        # cleanly, which the torch.export-based one does not for this model
+        torch.onnx.export(model, (example,), str(fp32_path), input_names=["images"], output_names=["logits"],
+                          opset_version=17, dynamo=False)
+        if quantize:
+            try:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+            except ImportError as e:
+                raise RuntimeError("ONNX quantisation needs onnxruntime (pip install onnxruntime)") from e
+            quantize_dynamic(str(fp32_path), str(out_path), weight_type=QuantType.QInt8)
+    else:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    print(f"[INFO] Exported {checkpoint} -> {out_path} ({out_path.stat().st_size / 1e6:.1f} MB)")
+    return out_path
+
+
+class BeamPredictor:
+    # Runs an exported artefact (.pt TorchScript or .onnx). Batches are always padded to
+    # batch_size so the runtime sees one input shape.
+
+    def __init__(self, artifact, batch_size=1, num_threads=None):
+        self.artifact = Path(artifact)
+        self.batch_size = batch_size
+        if self.artifact.suffix == ".onnx":
+            try:
+                import onnxruntime as ort
+            except ImportError as e:
+                raise RuntimeError("Running .onnx models needs onnxruntime (pip install onnxruntime)") from e
+            options = ort.SessionOptions()
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+                options.inter_op_num_threads = 1
+            self.session = ort.InferenceSession(str(self.artifact), options, providers=["CPUExecutionProvider"])
+            self.input_name = self.session.get_inputs()[0].name
+            self.model = None
+        else:
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            self.model = torch.jit.load(str(self.artifact), map_location="cpu")
+            self.session = None
+
+    def _run(self, batch):
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: batch.numpy()})[0]
+        with torch.inference_mode():
+            return self.model(batch).numpy()
+
+    def predict_logits(self, images):
+        # images: N x 3 x 224 x 224 float tensor, already normalised
+        outputs = []
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            n = len(chunk)
+            if n < self.batch_size:
+                pad = torch.zeros((self.batch_size - n,) + tuple(chunk.shape[1:]), dtype=chunk.dtype)
+                chunk = torch.cat((chunk, pad))
+            outputs.append(self._run(chunk.contiguous())[:n])
+        return np.concatenate(outputs) if outputs else np.zeros((0, NUM_CLASSES), dtype=np.float32)
+
+    def predict_jpegs(self, jpegs):
+        # Class probabilities for encoded images, preprocessed exactly like evaluation
+        arrays = [(decode_resized(data, INPUT_SIZE), 0) for data in jpegs]
+        logits = self.predict_logits(normalize_batch(arrays)[0])
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+
+def benchmark(predictor, n=200, warmup=10):
+    images = torch.randn((predictor.batch_size, 3) + INPUT_SIZE)
+    for _ in range(warmup):
+        predictor.predict_logits(images)
+    per_image = []
+    for _ in range(n):
+        start = time.perf_counter()
+        predictor.predict_logits(images)
+        per_image.append((time.perf_counter() - start) * 1000.0 / predictor.batch_size)
+    ms = np.array(per_image)
+    result = {"mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+              "p99_ms": float(np.percentile(ms, 99))}
+    print(f"[INFO] {predictor.artifact.name} (batch {predictor.batch_size}): per image mean "
+          f"{result['mean_ms']:.1f} ms  p50 {result['p50_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms")
+    return result
+
+
+def parity_check(predictor, checkpoint, samples, batch_size=16):
+    # Compares the artefact against the eager float32 model on the same samples, using
+    # the same preprocessing and argmax as Validation.ipynb's evaluate()
+    from torchvision import transforms
+
+    from dataset import ImageArrayDataset, make_loader
+
+    transform = transforms.Compose([
+        transforms.Resize(INPUT_SIZE),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+    loader = make_loader(ImageArrayDataset(samples, transform), batch_size=batch_size, num_workers=0)
+    model = build_model(checkpoint)
+    eager, exported, labels = [], [], []
+    with torch.no_grad():
+        for images, targets in loader:
+            eager.append(model(images).argmax(1).numpy())
+            exported.append(predictor.predict_logits(images).argmax(1))
+            labels.append(targets.numpy())
+    eager, exported, labels = np.concatenate(eager), np.concatenate(exported), np.concatenate(labels)
+    result = {"eager_acc": float(np.mean(eager == labels)), "exported_acc": float(np.mean(exported == labels)),
+              "agreement": float(np.mean(eager == exported))}
+    print(f"[INFO] {predictor.artifact.name}: accuracy {result['exported_acc']:.4f} vs eager "
+          f"{result['eager_acc']:.4f}, same prediction on {result['agreement'] * 100:.1f}% of samples")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and benchmark the beam predictor for CPU inference")
+    parser.add_argument("checkpoint", nargs="?", default="vit_tiny_combined_best.pth")
+    parser.add_argument("--out-dir", default="exported")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--formats", nargs="+", default=["torchscript", "onnx"])
+    parser.add_argument("--parity", nargs="*", default=[], help="dataset folders to check accuracy on")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    samples = []
+    if args.parity:
+        from manifest import scan_folder
+        from shards import ShardReader, find_shards
+        for folder in args.parity:
+            shard_dir = find_shards(folder)
+            samples.extend(ShardReader(shard_dir).samples() if shard_dir else scan_folder(folder).samples())
+
+    for fmt in args.formats:
+        suffix = ".pt" if fmt == "torchscript" else ".onnx"
+        for quantize in (False, True):
+            path = out_dir / f"vit_tiny_{'int8' if quantize else 'fp32'}{suffix}"
+            export_model(args.checkpoint, path, fmt, quantize, args.batch_size)
+            predictor = BeamPredictor(path, args.batch_size, args.threads)
+            benchmark(predictor)
+            if samples:
+                parity_check(predictor, args.checkpoint, samples)
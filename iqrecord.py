@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from powerchain import make_chain
+
+# Raw fc32 captures (interleaved float32 I/Q, i.e. complex64) with a JSON sidecar:
+#   survey.fc32  +  survey.json {samp_rate, center_freq, gain, decimating, start_time, markers: [...]}
+
+
+def sidecar_path(data_path):
+    return Path(data_path).with_suffix(".json")
+
+
+class IQRecorder:
+    # Writes the sidecar for a capture that a file sink is streaming to disk. Beam-switch
+    # markers are stored with the sample index the file sink had reached at that moment.
+
+    def __init__(self, data_path, samp_rate, center_freq, gain, sample_counter=None, decimating=False):
+        # decimating: the capture's power came from the decimating chain (DECIMATE_POWER)
+        self.data_path = Path(data_path)
+        self.meta = {
+            "format": "fc32",
+            "samp_rate": samp_rate,
+            "center_freq": center_freq,
+            "gain": gain,
+            "decimating": bool(decimating),
+            "start_time": None,
+            "start_iso": None,
+            "markers": [],
+        }
+        self.sample_counter = sample_counter
+        self._lock = threading.Lock()
+
+    def begin(self):
+        self.meta["start_time"] = time.time()
+        self.meta["start_iso"] = datetime.now().isoformat(timespec="milliseconds")
+        self._write()
+
+    def mark(self, label):
+        now = time.time()
+        if self.sample_counter is not None:
+            sample = int(self.sample_counter())
+        else:
+            sample = int((now - self.meta["start_time"]) * self.meta["samp_rate"])
+        with self._lock:
+            self.meta["markers"].append({"sample": sample, "time": now, "label": str(label)})
+            self._write()
+        return sample
+
+    def _write(self):
+        # Atomic replace so a crash mid-survey never leaves a truncated sidecar
+        path = sidecar_path(self.data_path)
+        tmp = path.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(tmp, path)
+
+
+class IQRecording:
+    # Read-only, memory-mapped view of a capture; slices are views into the page cache
+
+    def __init__(self, data_path):
+        self.data_path = Path(data_path)
+        with open(sidecar_path(self.data_path)) as f:
+            self.meta = json.load(f)
+        self.samp_rate = self.meta["samp_rate"]
+        self.markers = self.meta.get("markers", [])
+        if os.path.getsize(self.data_path) == 0:
+            self.samples = np.zeros(0, dtype=np.complex64)
+        else:
+            self.samples = np.memmap(self.data_path, dtype=np.complex64, mode="r")
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.samp_rate
+
+    def chunks(self, chunk_size=1 << 20, start=0, stop=None):
+        stop = len(self.samples) if stop is None else min(stop, len(self.samples))
+        for offset in range(start, stop, chunk_size):
+            yield self.samples[offset:min(offset + chunk_size, stop)]
+
+    def power_vectors(self, start=0, stop=None, decimating=None, **chain_kwargs):
+        # Re-runs power extraction, optionally with different filter/averaging settings.
+        # decimating picks the chain (DecimatingPowerChain or PowerChain); by default the
+        # one the capture was made with.
+        if decimating is None:
+            decimating = self.meta.get("decimating", False)
+        chain_kwargs.setdefault("samp_rate", self.samp_rate)
+        chain = make_chain(decimating, **chain_kwargs)
+        vectors = [chain.process_chunk(chunk) for chunk in self.chunks(chain.chunk_size, start, stop)]
+        if not vectors:
+            return np.zeros((0, chain.vlen), dtype=np.float32)
+        return np.concatenate(vectors)
+
+    def gr_source(self, repeat=False):
+        # File source for feeding the capture through the signalpow flowgraph itself
+        from gnuradio import blocks, gr
+        return blocks.file_source(gr.sizeof_gr_complex*1, str(self.data_path), repeat)
+
+
+def write_recording(data_path, iq, samp_rate=1000000, center_freq=890000000, gain=20, markers=(),
+                    decimating=False):
+    # Saves an in-memory capture (e.g. powerchain.synthetic_iq) in the recording format
+    np.asarray(iq, dtype=np.complex64).tofile(data_path)
+    recorder = IQRecorder(data_path, samp_rate, center_freq, gain, decimating=decimating)
+    recorder.begin()
+    for sample, label in markers:
+        recorder.meta["markers"].append({"sample": int(sample),
+                                         "time": recorder.meta["start_time"] + sample / samp_rate,
+                                         "label": str(label)})
+    recorder._write()
+    return IQRecording(data_path)
@@ -0,0 +1,135 @@
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from shards import labels_from_powers
+
+# Per-folder index of <timestamp>.jpg + <timestamp>.npy samples. The beam-power vectors
+# and labels are kept in one .npz next to the data, so loading a dataset is a directory
+# listing plus one file read; only pairs whose size or mtime changed are re-read.
+
+MANIFEST_NAME = "manifest.npz"
+IMAGE_EXTS = (".jpg", ".png")
+
+
+class FileSample(namedtuple("FileSample", ["img_path", "npy_path", "label"])):
+
+    def open_image(self):
+        from PIL import Image
+        return Image.open(self.img_path)
+
+
+class Manifest:
+
+    def __init__(self, folder, columns):
+        self.folder = Path(folder)
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["name"])
+
+    @property
+    def labels(self):
+        return self.columns["label"]
+
+    @property
+    def powers(self):
+        return self.columns["powers"]
+
+    @property
+    def full(self):
+        # Full sweeps, checked against each sample's own beams (older folders have fewer)
+        own = np.arange(self.powers.shape[1]) < self.columns["n_beams"][:, None]
+        return ~(np.isnan(self.powers) & own).any(axis=1)
+
+    def samples(self, partial=False):
+        # Training samples: full sweeps only, unless partial is set
+        folder = str(self.folder)
+        keep = np.ones(len(self), dtype=bool) if partial else self.full
+        if not keep.all():
+            print(f"[INFO] {folder}: leaving out {int((~keep).sum())} partial (guided) sweeps from the labels")
+        return [FileSample(os.path.join(folder, img), os.path.join(folder, name + ".npy"), int(label))
+                for name, img, label, kept in zip(self.columns["name"], self.columns["image"], self.columns["label"],
+                                                  keep) if kept]
+
+    @classmethod
+    def load(cls, folder):
+        path = Path(folder) / MANIFEST_NAME
+        try:
+            with np.load(path) as data:
+                return cls(folder, {key: data[key] for key in data.files})
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self):
+        path = self.folder / MANIFEST_NAME
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **self.columns)
+        os.replace(tmp, path)
+
+
+def scan_folder(folder, save=True):
+    # Builds or refreshes the folder's manifest. DirEntry.stat() comes from the directory
+    # listing itself on Windows, so unchanged samples cost no extra file access.
+    start = time.perf_counter()
+    folder = Path(folder)
+    previous = Manifest.load(folder)
+    known = {}
+    if previous is not None:
+        known = {name: i for i, name in enumerate(previous.columns["name"])}
+
+    stats = {entry.name: entry.stat() for entry in os.scandir(folder) if entry.is_file()}
+    rows = []
+    reread = 0
+    for fname in sorted(stats):
+        base, ext = os.path.splitext(fname)
+        npy_name = base + ".npy"
+        if ext.lower() not in IMAGE_EXTS or npy_name not in stats:
+            continue
+        img_stat, npy_stat = stats[fname], stats[npy_name]
+        row = {"name": base, "image": fname,
+               "img_size": img_stat.st_size, "img_mtime": img_stat.st_mtime_ns,
+               "npy_size": npy_stat.st_size, "npy_mtime": npy_stat.st_mtime_ns}
+        i = known.get(base)
+        if i is not None and all(previous.columns[key][i] == row[key]
+                                 for key in ("image", "img_size", "img_mtime", "npy_size", "npy_mtime")):
+            powers = previous.columns["powers"][i]
+            powers = powers[:int(previous.columns["n_beams"][i])]
+        else:
+            powers = np.load(folder / npy_name).astype(np.float32).ravel()
+            reread += 1
+        row["powers"] = powers
+        rows.append(row)
+
+    width = max((len(row["powers"]) for row in rows), default=0)
+    powers = np.full((len(rows), width), np.nan, dtype=np.float32)
+    for i, row in enumerate(rows):
+        powers[i, :len(row["powers"])] = row["powers"]
+    columns = {
+        "name": np.array([row["name"] for row in rows], dtype=str),
+        "image": np.array([row["image"] for row in rows], dtype=str),
+        "img_size": np.array([row["img_size"] for row in rows], dtype=np.int64),
+        "img_mtime": np.array([row["img_mtime"] for row in rows], dtype=np.int64),
+        "npy_size": np.array([row["npy_size"] for row in rows], dtype=np.int64),
+        "npy_mtime": np.array([row["npy_mtime"] for row in rows], dtype=np.int64),
+        "n_beams": np.array([len(row["powers"]) for row in rows], dtype=np.int64),
+        "powers": powers,
+        # Strongest measured beam; samples() leaves out partial sweeps, whose NaN beams
+        # would make this the guiding model's own pick
+        "label": labels_from_powers(powers) if len(rows) else np.zeros(0, dtype=np.int64),
+    }
+    manifest = Manifest(folder, columns)
+    if save and (previous is None or reread or len(previous) != len(manifest)):
+        manifest.save()
+    print(f"[INFO] {folder}: {len(manifest)} samples ({reread} re-read) in {time.perf_counter() - start:.2f} s")
+    return manifest
+
+
+if __name__ == "__main__":
+    import sys
+    for folder in sys.argv[1:]:
+        scan_folder(folder)
@@ -0,0 +1,112 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+Photo = namedtuple("Photo", ["frame_id", "data", "latency"])
+
+
+class PhotoClient:
+    # Shared HTTP client for the phone's camera server: one keep-alive connection pool
+    # with explicit connect/read timeouts and retries, instead of a new TCP connection
+    # for every requests.get
+
+    def __init__(self, base_url, connect_timeout=3.0, read_timeout=30.0, retries=2, backoff=0.2, pool_size=4):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff,
+                      status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        # /take_photo is not idempotent: once the request has reached the server a retry
+        # would trigger a second capture, so it is only retried if it never connected
+        capture_retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=backoff)
+        capture_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=capture_retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.mount(self.base_url + "/take_photo", capture_adapter)  # longest prefix wins
+
+    def _get_photo(self, path, size=None, quality=None, timeout=None):
+        params = {}
+        if size is not None:
+            params["width"], params["height"] = size
+        if quality is not None:
+            params["quality"] = quality
+        start = time.perf_counter()
+        res = self.session.get(self.base_url + path, params=params, timeout=timeout or self.timeout)
+        res.raise_for_status()
+        frame_id = res.headers.get("X-Frame-Id")
+        return Photo(int(frame_id) if frame_id else None, res.content, time.perf_counter() - start)
+
+    def take_photo(self, size=None, quality=None):
+        # A fresh capture; size=(w, h) asks the server for a downscaled copy
+        return self._get_photo("/take_photo", size, quality)
+
+    def fetch_frame(self, frame_id, size=None, quality=None):
+        # Another copy (e.g. full resolution) of a frame that was already captured
+        return self._get_photo(f"/frame/{frame_id}", size, quality)
+
+    def ping(self, timeout=3):
+        # "good" on a pong, "warning" if the server answers with anything else, "bad" if
+        # it cannot be reached
+        try:
+            res = self.session.get(self.base_url + "/ping", timeout=timeout)
+        except requests.RequestException:
+            return "bad"
+        return "good" if res.status_code == 200 and "pong" in res.text.lower() else "warning"
+
+    def close(self):
+        self.session.close()
+
+
+def measure_latency(base_url, n=20, preview_size=(400, 300)):
+    # Capture-to-display latency (fetch plus decode to preview size): new connection per
+    # request vs. the pooled client, full-size vs. preview-size transfers
+    import io
+    from PIL import Image
+
+    def display(data):
+        Image.open(io.BytesIO(data)).convert("RGB").resize(preview_size)
+
+    def timed(fetch):
+        values = []
+        for _ in range(n):
+            start = time.perf_counter()
+            display(fetch())
+            values.append((time.perf_counter() - start) * 1000.0)
+        return np.array(values)
+
+    client = PhotoClient(base_url)
+    results = {
+        "bare requests, full size": timed(lambda: requests.get(base_url + "/take_photo", timeout=30).content),
+        "pooled client, full size": timed(lambda: client.take_photo().data),
+        "pooled client, preview": timed(lambda: client.take_photo(size=preview_size, quality=80).data),
+    }
+    client.close()
+    for name, ms in results.items():
+        print(f"[INFO] {name:<26} mean {ms.mean():7.1f} ms  p95 {np.percentile(ms, 95):7.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    # Runs take_photo.py's Flask app locally with the fake camera and measures it
+    import logging
+    import tempfile
+    import threading
+
+    from werkzeug.serving import make_server
+
+    import take_photo
+
+    take_photo.camera = take_photo.CameraWorker(capture_fn=take_photo.fake_capture,
+                                                output_dir=tempfile.mkdtemp(prefix="fake_camera_"))
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, take_photo.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        measure_latency(f"http://127.0.0.1:{server.server_port}")
+    finally:
+        server.shutdown()
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from dataset import ImageArrayDataset, make_loader
+from image_cache import sample_digest
+from inference import NUM_CLASSES
+
+# Logits for every sample under a given checkpoint, cached on disk. Keys are the
+# checkpoint's content hash and each image's content hash, so evaluating the same
+# checkpoint again (e.g. after adding data) only runs the model on samples it has not
+# scored yet. Per-fold metrics are then just slices of one prediction array.
+
+PREPROCESS = "resize224-imagenet"  # bump when the evaluation transform changes
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+
+    def __init__(self, cache_dir, checkpoint, preprocess=PREPROCESS):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        key = hashlib.blake2b(f"{file_hash(checkpoint)}:{preprocess}".encode(), digest_size=12).hexdigest()
+        self.path = self.cache_dir / f"logits-{key}.npz"
+        self.digests = np.zeros(0, dtype="U32")
+        self.logits = None
+        if self.path.exists():
+            with np.load(self.path) as data:
+                self.digests, self.logits = data["digests"], data["logits"]
+        self.rows = {digest: i for i, digest in enumerate(self.digests.tolist())}
+
+    def __len__(self):
+        return len(self.digests)
+
+    def lookup(self, digests):
+        # Row of each digest in the cache, -1 where it has not been scored
+        return np.array([self.rows.get(digest, -1) for digest in digests], dtype=np.int64)
+
+    def add(self, digests, logits):
+        new, seen = [], set()
+        for i, digest in enumerate(digests):
+            if digest not in self.rows and digest not in seen:
+                seen.add(digest)
+                new.append(i)
+        if not new:
+            return
+        digests = np.array([digests[i] for i in new], dtype="U32")
+        logits = np.asarray(logits, dtype=np.float32)[new]
+        for i, digest in enumerate(digests.tolist()):
+            self.rows[digest] = len(self.digests) + i
+        self.digests = np.concatenate((self.digests, digests))
+        self.logits = logits if self.logits is None else np.concatenate((self.logits, logits))
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, digests=self.digests, logits=self.logits)
+        os.replace(tmp, self.path)
+
+
+def run_inference(model, loader, device):
+    outputs = []
+    with torch.no_grad():
+        for images, _ in loader:
+            outputs.append(model(images.to(device, non_blocking=True)).float().cpu())
+    return torch.cat(outputs).numpy()
+
+
+def predict_logits(samples, checkpoint, model_fn, device, cache_dir, transform=None, image_cache=None,
+                   batch_size=64, num_classes=NUM_CLASSES):
+    # Logits for samples (in order), shape (len(samples), num_classes). model_fn() is only
+    # called, once, if some samples have not been scored with this checkpoint before.
+    start = time.perf_counter()
+    cache = PredictionCache(cache_dir, checkpoint)
+    if not len(samples):
+        width = cache.logits.shape[1] if cache.logits is not None else num_classes
+        return np.zeros((0, width), dtype=np.float32)
+    # The image cache already knows the digest of every file it has seen unchanged
+    if image_cache is not None:
+        digests = image_cache.digests_for(samples)
+    else:
+        digests = [sample_digest(sample).hex() for sample in samples]
+    rows = cache.lookup(digests)
+    missing = np.flatnonzero(rows < 0)
+    if len(missing):
+        model = model_fn()
+        model.eval()
+        subset = [samples[i] for i in missing]
+        loader = make_loader(ImageArrayDataset(subset, transform, cache=image_cache),
+                             batch_size=batch_size, device=device, persistent_workers=False)
+        cache.add([digests[i] for i in missing], run_inference(model, loader, device))
+        rows = cache.lookup(digests)
+    print(f"[INFO] Scored {len(missing)} of {len(samples)} samples "
+          f"({len(samples) - len(missing)} cached) in {time.perf_counter() - start:.1f} s")
+    return cache.logits[rows]
@@ -0,0 +1,420 @@
+import io
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# Append-only sharded dataset container. Each shard file is laid out as
+#
+#   MAGIC | jpeg 0 | jpeg 1 | ... | column arrays | JSON footer | trailer
+#
+# The column arrays hold one record per image (timestamp, beam powers, pose, capture
+# metadata, image offset/length). The footer describes where each column lives, and
+# the fixed-size trailer points at the footer. Until the shard is finalised, every
+# record is also appended to a JSON-lines journal next to it (shard-*.bin.journal) and
+# synced to disk with its image, so a survey that dies mid-shard loses at most the
+# sample being written: the reader recovers an unfinalised shard from its journal, and
+# the next ShardWriter on the directory finalises it.
+
+MAGIC = b"BEAMSHD1"
+TRAILER = struct.Struct("<QQ8s")  # footer offset, footer length, magic
+ALIGN = 16
+SHARD_GLOB = "shard-*.bin"
+
+COLUMNS = {
+    "timestamp": np.float64,  # unix seconds
+    "x": np.float32,
+    "y": np.float32,
+    "yaw": np.float32,
+    "row": np.int32,
+    "col": np.int32,
+    "image_offset": np.uint64,
+    "image_length": np.uint64,
+}
+NAME_DTYPE = "U32"
+JOURNAL_SUFFIX = ".journal"
+SURVEY_BEAMS = ["0", "1", "3", "4"]  # beam 2 is left out of the current survey
+# Labels index the beam columns, so model class i is CLASS_BEAMS[i]; the classifier's head
+# may have spare classes past the end
+CLASS_BEAMS = SURVEY_BEAMS
+
+
+def labels_from_powers(powers):
+    # Index of the strongest measured beam; unmeasured beams are NaN
+    filled = np.where(np.isnan(powers), -np.inf, powers)
+    return filled.argmax(axis=1)
+
+
+def full_sweeps(powers):
+    # Rows where every beam was measured. A guided sweep leaves the beams it skipped as NaN,
+    # so its strongest beam is the model's own pick and it must not be trained on.
+    return ~np.isnan(powers).any(axis=1)
+
+
+class ShardWriter:
+
+    def __init__(self, directory, beams, max_records=1024, meta=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.beams = list(beams)
+        self.max_records = max_records
+        self.meta = meta or {}
+        self._lock = threading.Lock()
+        existing = sorted(self.directory.glob(SHARD_GLOB))
+        for path in existing:
+            if read_footer(path) is None:
+                repair_shard(path)
+        self._next_index = int(existing[-1].stem.split("-")[1]) + 1 if existing else 0
+        self._file = None
+
+    def _open(self):
+        self.path = self.directory / f"shard-{self._next_index:05d}.bin"
+        self._next_index += 1
+        self._file = open(self.path, "wb")
+        self._file.write(MAGIC)
+        self._journal = open(journal_path(self.path), "w")
+        self._journal.write(json.dumps({"beams": self.beams, "meta": self.meta}) + "\n")
+        self._columns = {name: [] for name in COLUMNS}
+        self._names = []
+        self._powers = []
+
+    def append(self, image_bytes, powers, timestamp=None, name="", x=np.nan, y=np.nan, yaw=np.nan,
+               row=-1, col=-1):
+        powers = np.asarray(powers, dtype=np.float32)
+        if powers.shape != (len(self.beams),):
+            raise ValueError(f"Expected {len(self.beams)} beam powers, got shape {powers.shape}")
+        with self._lock:
+            if self._file is None:
+                self._open()
+            offset = self._file.tell()
+            self._file.write(image_bytes)
+            record = {
+                "timestamp": time.time() if timestamp is None else timestamp,
+                "x": x, "y": y, "yaw": yaw, "row": row, "col": col,
+                "image_offset": offset, "image_length": len(image_bytes),
+            }
+            for column, value in record.items():
+                self._columns[column].append(value)
+            self._names.append(name)
+            self._powers.append(powers)
+            # Image first, then its journal line: a journalled record always has its image.
+            # Two syncs per sample, a few ms at survey rates.
+            _sync(self._file)
+            record.update(name=name, powers=powers.tolist())
+            self._journal.write(json.dumps(record, default=float) + "\n")
+            _sync(self._journal)
+            if len(self._names) >= self.max_records:
+                self._finalise()
+
+    def _finalise(self):
+        columns = {name: np.array(values, dtype=COLUMNS[name]) for name, values in self._columns.items()}
+        columns["name"] = np.array(self._names, dtype=NAME_DTYPE)
+        columns["powers"] = np.stack(self._powers)
+        _write_index(self._file, columns, self.beams, self.meta)
+        self._file.close()
+        self._file = None
+        self._journal.close()
+        os.remove(journal_path(self.path))
+
+    def flush(self):
+        # Finalises the current shard so everything written so far is readable
+        with self._lock:
+            if self._file is not None:
+                self._finalise()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _write_index(f, columns, beams, meta):
+    # Column arrays, footer and trailer after the images; completes the shard
+    layout = {}
+    for name, array in columns.items():
+        f.write(b"\0" * (-f.tell() % ALIGN))
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": f.tell()}
+        f.write(array.tobytes())
+
+    footer = json.dumps({
+        "version": 1,
+        "count": len(columns["name"]),
+        "beams": beams,
+        "meta": meta,
+        "columns": layout,
+    }).encode()
+    footer_offset = f.tell()
+    f.write(footer)
+    f.write(TRAILER.pack(footer_offset, len(footer), MAGIC))
+    _sync(f)
+
+
+def journal_path(path):
+    return path.with_name(path.name + JOURNAL_SUFFIX)
+
+
+def read_footer(path):
+    # The finalised shard's footer, or None
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < len(MAGIC) + TRAILER.size:
+            return None
+        f.seek(size - TRAILER.size)
+        footer_offset, footer_length, magic = TRAILER.unpack(f.read(TRAILER.size))
+        if magic != MAGIC:
+            return None
+        f.seek(footer_offset)
+        return json.loads(f.read(footer_length))
+
+
+def read_journal(path):
+    # (header, columns) of the records of an unfinalised shard whose images are complete
+    # on disk, or None without a journal. A torn last line is dropped.
+    try:
+        with open(journal_path(path)) as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
+        return None
+    size = os.path.getsize(path)
+    header, records = None, []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            break
+        if header is None:
+            header = entry
+        elif entry["image_offset"] + entry["image_length"] <= size:
+            records.append(entry)
+        else:
+            break
+    if header is None:
+        return None
+    columns = {name: np.array([r[name] for r in records], dtype=dtype) for name, dtype in COLUMNS.items()}
+    columns["name"] = np.array([r["name"] for r in records], dtype=NAME_DTYPE)
+    columns["powers"] = np.array([r["powers"] for r in records], dtype=np.float32).reshape(
+        len(records), len(header["beams"]))
+    return header, columns
+
+
+def repair_shard(path):
+    # Finalises a shard a crashed writer left behind, from its journal. Returns the
+    # number of records kept, or None if there is no journal to recover from.
+    recovered = read_journal(path)
+    if recovered is None:
+        return None
+    header, columns = recovered
+    count = len(columns["name"])
+    end = int(columns["image_offset"][-1] + columns["image_length"][-1]) if count else len(MAGIC)
+    with open(path, "r+b") as f:
+        f.truncate(end)  # drop a partly written image
+        f.seek(end)
+        _write_index(f, columns, header["beams"], header["meta"])
+    os.remove(journal_path(path))
+    print(f"[INFO] Recovered {count} records into unfinalised shard {path}")
+    return count
+
+
+class ShardSample(namedtuple("ShardSample", ["reader", "index"])):
+    # Stands in for an (img_path, npy_path) pair in the sample lists used for training
+
+    def open_image(self):
+        from PIL import Image
+        return Image.open(io.BytesIO(self.reader.image_bytes(self.index)))
+
+    @property
+    def powers(self):
+        return self.reader.columns["powers"][self.index]
+
+    @property
+    def label(self):
+        return int(self.reader.labels[self.index])
+
+
+class ShardReader:
+    # Random access over every shard in a directory (unfinalised ones from their journal).
+    # Images are sliced out of memory-mapped shard files; columns are concatenated
+    # across shards.
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.paths = []
+        footers = []
+        for path in sorted(self.directory.glob(SHARD_GLOB)):
+            footer = read_footer(path)
+            if footer is None:
+                # Still being written, or its writer died: read what the journal holds
+                recovered = read_journal(path)
+                if recovered is None:
+                    print(f"[WARN] Skipping unfinalised shard {path} (no journal)")
+                    continue
+                header, columns = recovered
+                footer = {"count": len(columns["name"]), "beams": header["beams"], "journal": columns}
+            self.paths.append(path)
+            footers.append(footer)
+
+        self.beams = max((footer["beams"] for footer in footers), key=len, default=[])
+        counts = [footer["count"] for footer in footers]
+        self.starts = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.columns, self.full = self._load_columns(footers)
+        self.labels = labels_from_powers(self.columns["powers"]) if len(self) else np.zeros(0, dtype=np.int64)
+        self._maps = {}
+
+    def _load_columns(self, footers):
+        parts = {name: [] for name in list(COLUMNS) + ["name", "powers"]}
+        full = []
+        for path, footer in zip(self.paths, footers):
+            columns = footer.get("journal") or self._read_columns(path, footer)
+            for name, array in columns.items():
+                if name == "powers":
+                    full.append(full_sweeps(array))  # before padding, against the shard's own beams
+                if name == "powers" and array.shape[1] < len(self.beams):
+                    # Older shards with fewer beams: pad so argmax indices keep their meaning
+                    pad = np.full((array.shape[0], len(self.beams) - array.shape[1]), np.nan, np.float32)
+                    array = np.hstack((array, pad))
+                parts[name].append(array)
+        columns = {}
+        for name, arrays in parts.items():
+            if arrays:
+                columns[name] = np.concatenate(arrays)
+            elif name == "powers":
+                columns[name] = np.zeros((0, len(self.beams)), dtype=np.float32)
+            else:
+                columns[name] = np.zeros(0, dtype=COLUMNS.get(name, NAME_DTYPE))
+        return columns, np.concatenate(full) if full else np.zeros(0, dtype=bool)
+
+    @staticmethod
+    def _read_columns(path, footer):
+        columns = {}
+        with open(path, "rb") as f:
+            for name, spec in footer["columns"].items():
+                dtype = np.dtype(spec["dtype"])
+                count = int(np.prod(spec["shape"]))
+                f.seek(spec["offset"])
+                columns[name] = np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype).reshape(spec["shape"])
+        return columns
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def _locate(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return int(np.searchsorted(self.starts, index, side="right") - 1)
+
+    def _map(self, shard):
+        # Opened lazily so a reader can be pickled into DataLoader worker processes
+        mapped = self._maps.get(shard)
+        if mapped is None:
+            with open(self.paths[shard], "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = mapped
+        return mapped
+
+    def shard_path(self, index):
+        return self.paths[self._locate(index)]
+
+    def image_bytes(self, index):
+        shard = self._locate(index)
+        offset = int(self.columns["image_offset"][index])
+        length = int(self.columns["image_length"][index])
+        return memoryview(self._map(shard))[offset:offset + length]
+
+    def samples(self, partial=False):
+        # Training samples: full sweeps only, unless partial is set
+        if partial:
+            return [ShardSample(self, i) for i in range(len(self))]
+        skipped = len(self) - int(self.full.sum())
+        if skipped:
+            print(f"[INFO] Leaving out {skipped} partial (guided) sweeps from the labels")
+        return [ShardSample(self, int(i)) for i in np.flatnonzero(self.full)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+
+def find_shards(folder):
+    # The folder itself or its shards/ subfolder, whichever holds shard files
+    for candidate in (Path(folder), Path(folder) / "shards"):
+        if candidate.is_dir() and any(candidate.glob(SHARD_GLOB)):
+            return candidate
+    return None
+
+
+def convert_folder(folder, out_dir=None, beams=None, max_records=1024):
+    # Packs an existing folder of <timestamp>.jpg + <timestamp>.npy pairs into shards.
+    # Samples already in out_dir's shards (by name) are skipped, so running it again only
+    # adds pairs that are new since the last run.
+    folder = Path(folder)
+    out_dir = Path(out_dir) if out_dir is not None else folder / "shards"
+    packed = set()
+    if out_dir.is_dir() and any(out_dir.glob(SHARD_GLOB)):
+        reader = ShardReader(out_dir)
+        packed = set(reader.columns["name"].tolist())
+        reader.close()
+    pairs, skipped = [], 0
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        base, ext = os.path.splitext(entry.name)
+        if ext.lower() in (".jpg", ".png") and os.path.exists(folder / (base + ".npy")):
+            if base in packed:
+                skipped += 1
+                continue
+            pairs.append((base, folder / entry.name, folder / (base + ".npy")))
+    if not pairs and not skipped:
+        raise FileNotFoundError(f"No image/.npy pairs found in {folder}")
+    if not pairs:
+        print(f"[INFO] All {skipped} samples from {folder} are already in {out_dir}")
+        return out_dir
+
+    vectors = [np.load(npy_path).ravel() for _, _, npy_path in pairs]
+    # The GUI's beam order: survey .npy files hold beams 0, 1, 3, 4
+    beams = list(SURVEY_BEAMS if beams is None else beams)
+    longest = max(len(v) for v in vectors)
+    if longest > len(beams):
+        raise ValueError(f"{folder} has {longest}-beam power vectors; pass beams= with their names")
+    with ShardWriter(out_dir, beams, max_records=max_records, meta={"source": str(folder)}) as writer:
+        for (base, img_path, _), values in zip(pairs, vectors):
+            powers = np.full(len(beams), np.nan, dtype=np.float32)
+            powers[:len(values)] = values
+            writer.append(img_path.read_bytes(), powers, timestamp=_timestamp_from_name(base), name=base)
+    print(f"[INFO] Packed {len(pairs)} samples from {folder} into {out_dir}"
+          + (f" ({skipped} already there)" if skipped else ""))
+    return out_dir
+
+
+def _timestamp_from_name(base):
+    match = re.match(r"(\d{8}_\d{6})", base)
+    if match is None:
+        return np.nan
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+
+
+if __name__ == "__main__":
+    import sys
+    for folder in sys.argv[1:]:
+        convert_folder(folder)
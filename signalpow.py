@@ -20,13 +20,85 @@ from gnuradio.eng_arg import eng_float, intx
 from gnuradio import eng_notation
 from gnuradio import uhd
 import time
-
-
+import math
+import threading
+from collections import deque
+import numpy as np
+from iqrecord import IQRecorder
+from powerchain import PowerMeasurement, block_means, find_settled, make_chain, skip_samples
+from continuous_sweep import ContinuousSweep, calibrate_latency
+from tracing import span
+
+
+
+
+class power_vector_sink(gr.sync_block):
+    # Keeps the most recent power vectors in a ring buffer, stamped with arrival time (ms)
+
+    def __init__(self, vlen=4096, depth=512, samp_rate=1000000, skip=0):
+        gr.sync_block.__init__(self, name="power_vector_sink", in_sig=[(np.float32, vlen)], out_sig=None)
+        self.vlen = vlen
+        self.samp_rate = samp_rate  # of the power stream, i.e. before stream_to_vector
+        self.skip = skip  # samples to drop after a request (powerchain.skip_samples)
+        self.ring = deque(maxlen=depth)
+        self.count = 0
+        self.last_ms = None
+        self.cond = threading.Condition()
+
+    def work(self, input_items, output_items):
+        now_ms = time.time() * 1000.0
+        vectors = input_items[0]
+        with self.cond:
+            for vector in vectors:
+                self.ring.append((self.count, now_ms, vector.copy()))
+                self.count += 1
+            self.last_ms = now_ms
+            self.cond.notify_all()
+        return len(vectors)
+
+    def sample_index(self):
+        # Power-stream index of the sample arriving now, extrapolated from the last
+        # vector. It lags the radio by the pipeline latency, which ContinuousSweep allows for.
+        with self.cond:
+            if self.last_ms is None:
+                return 0
+            return self.count * self.vlen + int((time.time() * 1000.0 - self.last_ms) * self.samp_rate / 1000.0)
+
+    def read(self, start, stop, timeout):
+        # Power samples [start, stop) of the stream, waiting until they have arrived
+        deadline = time.monotonic() + timeout
+        first, last = start // self.vlen, -(-stop // self.vlen)
+        with self.cond:
+            while self.count < last:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Power samples up to {stop} did not arrive within {timeout} s")
+                self.cond.wait(remaining)
+            vectors = [vector for index, _, vector in self.ring if first <= index < last]
+        if len(vectors) < last - first:
+            raise RuntimeError(f"Power samples from {start} were already dropped from the ring buffer")
+        if not vectors:
+            return np.zeros(0, dtype=np.float32)
+        stream = np.concatenate(vectors)
+        return stream[start - first * self.vlen:stop - first * self.vlen]
+
+    def wait_for(self, n, after_ms, timeout):
+        # Blocks until n vectors newer than after_ms are buffered and returns them oldest first
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                fresh = [entry for entry in self.ring if entry[1] > after_ms]
+                if len(fresh) >= n:
+                    return fresh[:n]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Only {len(fresh)}/{n} power vectors arrived within {timeout} s")
+                self.cond.wait(remaining)
 
 
 class signalpow(gr.top_block):
 
-    def __init__(self):
+    def __init__(self, source=None, record_path=None, decimating=False):
         gr.top_block.__init__(self, "Not titled yet", catch_exceptions=True)
 
         ##################################################
@@ -35,41 +107,71 @@ class signalpow(gr.top_block):
         self.samp_rate = samp_rate = 1000000
         self.length = length = 1
         self.freq = freq = 890000000
+        self.gain = gain = 20
 
         ##################################################
         # Blocks
         ##################################################
 
-        self.uhd_usrp_source_0 = uhd.usrp_source(
-            ",".join(("serial=3123BA0", '')),
-            uhd.stream_args(
-                cpu_format="fc32",
-                args='',
-                channels=list(range(0,1)),
-            ),
-        )
-        self.uhd_usrp_source_0.set_subdev_spec("A:A", 0)
-        self.uhd_usrp_source_0.set_samp_rate(samp_rate)
-        # No synchronization enforced.
-
-        self.uhd_usrp_source_0.set_center_freq(freq, 0)
-        self.uhd_usrp_source_0.set_antenna("TX/RX", 0)
-        self.uhd_usrp_source_0.set_bandwidth(samp_rate, 0)
-        self.uhd_usrp_source_0.set_gain(20, 0)
-        self.low_pass_filter_0 = filter.fir_filter_ccf(
-            1,
-            firdes.low_pass(
+        if source is None:
+            self.uhd_usrp_source_0 = uhd.usrp_source(
+                ",".join(("serial=3123BA0", '')),
+                uhd.stream_args(
+                    cpu_format="fc32",
+                    args='',
+                    channels=list(range(0,1)),
+                ),
+            )
+            self.uhd_usrp_source_0.set_subdev_spec("A:A", 0)
+            self.uhd_usrp_source_0.set_samp_rate(samp_rate)
+            # No synchronization enforced.
+
+            self.uhd_usrp_source_0.set_center_freq(freq, 0)
+            self.uhd_usrp_source_0.set_antenna("TX/RX", 0)
+            self.uhd_usrp_source_0.set_bandwidth(samp_rate, 0)
+            self.uhd_usrp_source_0.set_gain(gain, 0)
+            self.source_out = self.uhd_usrp_source_0
+        else:
+            # File/vector source standing in for the USRP, throttled to the real sample rate
+            self.uhd_usrp_source_0 = None
+            self.blocks_throttle_0 = blocks.throttle(gr.sizeof_gr_complex*1, samp_rate, True)
+            self.connect((source, 0), (self.blocks_throttle_0, 0))
+            self.source_out = self.blocks_throttle_0
+        self.decimating = decimating
+        design = make_chain(decimating, samp_rate=samp_rate, chunk_size=1 << 13)
+        if decimating:
+            # Decimate to 20 kS/s in stages, then the same 5 kHz low-pass and 1 ms average
+            # at the reduced rate (powerchain.DecimatingPowerChain): about 5 filter taps per
+            # input sample instead of 2409, for the same bandwidth and averaging time
+            self.decimators = [filter.fir_filter_ccf(decim, taps.tolist()) for decim, taps in design.stages]
+            self.low_pass_filter_0 = filter.fir_filter_ccf(1, design.taps.tolist())
+            power_rate, vlen, avg_length = design.out_rate, design.vlen, design.avg_length
+        else:
+            self.decimators = []
+            self.low_pass_filter_0 = filter.fir_filter_ccf(
                 1,
-                samp_rate,
-                5000,
-                1000,
-                window.WIN_HAMMING,
-                6.76))
-        self.blocks_stream_to_vector_0 = blocks.stream_to_vector(gr.sizeof_float*1, 4096)
+                firdes.low_pass(
+                    1,
+                    samp_rate,
+                    5000,
+                    1000,
+                    window.WIN_HAMMING,
+                    6.76))
+            power_rate, vlen, avg_length = samp_rate, 4096, 1000
+        self.blocks_stream_to_vector_0 = blocks.stream_to_vector(gr.sizeof_float*1, vlen)
         self.blocks_nlog10_ff_0 = blocks.nlog10_ff(10, length, 0)
-        self.blocks_moving_average_xx_0 = blocks.moving_average_ff(1000, (1/1000), 4000, 1)
+        self.blocks_moving_average_xx_0 = blocks.moving_average_ff(avg_length, (1/avg_length), 4000, 1)
         self.blocks_complex_to_mag_squared_0 = blocks.complex_to_mag_squared(length)
-        self.Signal_power_vec = blocks.probe_signal_vf(4096)
+        self.Signal_power_vec = blocks.probe_signal_vf(vlen)
+        self.power_sink = power_vector_sink(vlen, samp_rate=power_rate, skip=skip_samples(design))
+        self.recorder = None
+        if record_path is not None:
+            # Tee the raw fc32 stream to disk; the sidecar tracks metadata and beam markers
+            self.blocks_file_sink_0 = blocks.file_sink(gr.sizeof_gr_complex*1, str(record_path), False)
+            self.blocks_file_sink_0.set_unbuffered(False)
+            self.recorder = IQRecorder(record_path, samp_rate, freq, gain,
+                                       sample_counter=lambda: self.blocks_file_sink_0.nitems_read(0),
+                                       decimating=decimating)
 
 
         ##################################################
@@ -79,18 +181,37 @@ class signalpow(gr.top_block):
         self.connect((self.blocks_moving_average_xx_0, 0), (self.blocks_nlog10_ff_0, 0))
         self.connect((self.blocks_nlog10_ff_0, 0), (self.blocks_stream_to_vector_0, 0))
         self.connect((self.blocks_stream_to_vector_0, 0), (self.Signal_power_vec, 0))
+        self.connect((self.blocks_stream_to_vector_0, 0), (self.power_sink, 0))
         self.connect((self.low_pass_filter_0, 0), (self.blocks_complex_to_mag_squared_0, 0))
-        self.connect((self.uhd_usrp_source_0, 0), (self.low_pass_filter_0, 0))
+        filters = self.decimators + [self.low_pass_filter_0]
+        for upstream, downstream in zip([self.source_out] + filters, filters):
+            self.connect((upstream, 0), (downstream, 0))
+        if self.recorder is not None:
+            self.connect((self.source_out, 0), (self.blocks_file_sink_0, 0))
+
+    def start(self, *args, **kwargs):
+        if self.recorder is not None:
+            self.recorder.begin()
+        gr.top_block.start(self, *args, **kwargs)
+
+    def mark(self, label):
+        # Beam-switch marker in the recording; a no-op when not recording
+        if self.recorder is not None:
+            return self.recorder.mark(label)
 
 
     def get_samp_rate(self):
         return self.samp_rate
 
     def set_samp_rate(self, samp_rate):
+        if self.decimating:
+            raise ValueError("The decimating chain is designed for its start-up sample rate; rebuild the flowgraph")
         self.samp_rate = samp_rate
+        self.power_sink.samp_rate = samp_rate
         self.low_pass_filter_0.set_taps(firdes.low_pass(1, self.samp_rate, 5000, 1000, window.WIN_HAMMING, 6.76))
-        self.uhd_usrp_source_0.set_samp_rate(self.samp_rate)
-        self.uhd_usrp_source_0.set_bandwidth(self.samp_rate, 0)
+        if self.uhd_usrp_source_0 is not None:
+            self.uhd_usrp_source_0.set_samp_rate(self.samp_rate)
+            self.uhd_usrp_source_0.set_bandwidth(self.samp_rate, 0)
 
     def get_length(self):
         return self.length
@@ -98,18 +219,47 @@ class signalpow(gr.top_block):
     def set_length(self, length):
         self.length = length
 
+    def get_gain(self):
+        return self.gain
+
+    def set_gain(self, gain):
+        self.gain = gain
+        if self.uhd_usrp_source_0 is not None:
+            self.uhd_usrp_source_0.set_gain(self.gain, 0)
+
     def get_freq(self):
         return self.freq
 
     def set_freq(self, freq):
         self.freq = freq
-        self.uhd_usrp_source_0.set_center_freq(self.freq, 0)
+        if self.uhd_usrp_source_0 is not None:
+            self.uhd_usrp_source_0.set_center_freq(self.freq, 0)
+
 
 
 
+def argument_parser():
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--record", dest="record", type=str, default=None,
+        help="Tee the raw fc32 stream to this file, with a .json metadata sidecar [default=%(default)r]")
+    parser.add_argument(
+        "--replay", dest="replay", type=str, default=None,
+        help="Stream a recorded fc32 file through the chain instead of the USRP [default=%(default)r]")
+    parser.add_argument(
+        "--decimate", dest="decimate", action="store_true",
+        help="Decimate to 20 kS/s before taking the power, for a fraction of the CPU")
+    return parser
+
 
 def main(top_block_cls=signalpow, options=None):
-    tb = top_block_cls()
+    if options is None:
+        options = argument_parser().parse_args()
+    source = None
+    if options.replay:
+        from iqrecord import IQRecording
+        source = IQRecording(options.replay).gr_source()
+    tb = top_block_cls(source=source, record_path=options.record, decimating=options.decimate)
 
     def sig_handler(sig=None, frame=None):
         tb.stop()
@@ -125,6 +275,41 @@ def main(top_block_cls=signalpow, options=None):
     tb.wait()
 
 
+def measure_settled(sink, samp_rate, window=4, ci_db=0.25, confidence=0.95, skip=None, timeout=0.5,
+                    block=None):
+    # Mean power (dB) once the stream is stable, instead of after a fixed wait. Vectors
+    # arriving after the request are joined and `skip` stream samples (default
+    # sink.skip: the first vector plus the filter settling time) are dropped, since the
+    # first vector can still hold samples from before the request. The rest is split
+    # into `block`-sample blocks; more vectors are read until `window` consecutive blocks
+    # pass find_settled's confidence-interval and drift test, or until the timeout (then
+    # settled=False and the latest window is used). samp_rate is the power stream's;
+    # blocks default to a quarter vector (about 1 ms).
+    block = block or sink.vlen // 4
+    skip = sink.skip if skip is None else skip
+    requested_ms = time.time() * 1000.0
+    deadline = time.monotonic() + timeout
+    n = max(1, math.ceil((skip + window * block) / sink.vlen))
+    with span("measure_settled") as s:
+        entries = sink.wait_for(n, requested_ms, timeout)
+        while True:
+            vectors = np.array([vector for _, _, vector in entries])
+            result = find_settled(block_means(vectors.ravel()[skip:], block), window, ci_db, confidence)
+            remaining = deadline - time.monotonic()
+            if result.settled or remaining <= 0:
+                break
+            try:
+                entries = sink.wait_for(n + 1, requested_ms, remaining)
+                n += 1
+            except TimeoutError:
+                break
+        settle_ms = 1000.0 * (skip + result.start * block) / samp_rate
+        s.set(vectors=n, settle_ms=settle_ms, ci_db=result.ci_db, settled=result.settled)
+    return PowerMeasurement(power=result.power, vectors=vectors, requested_ms=requested_ms,
+                            start_ms=entries[0][1], end_ms=entries[-1][1],
+                            settle_ms=settle_ms, ci_db=result.ci_db, settled=result.settled)
+
+
 def get_vector(top_block_cls=signalpow, options=None):
     tb = top_block_cls()
 
@@ -137,14 +322,77 @@ def get_vector(top_block_cls=signalpow, options=None):
     signal.signal(signal.SIGINT, sig_handler)
     signal.signal(signal.SIGTERM, sig_handler)
 
-    tb.start()
-    time.sleep(0.1)
-    vector = tb.Signal_power_vec.level()
+    with span("get_vector"):
+        tb.start()
+        # Returns as soon as the start-up transient has passed, rather than after a fixed 0.1 s
+        vector = measure_settled(tb.power_sink, tb.power_sink.samp_rate, timeout=1.0).vectors[-1]
 
     tb.stop()
     return vector
 
 
+class PowerService:
+    # Starts the flowgraph once and answers measurement requests from its ring buffer,
+    # instead of rebuilding the USRP source and filters for every get_vector() call.
+
+    def __init__(self, top_block_cls=signalpow, **kwargs):
+        self.tb = top_block_cls(**kwargs)
+        self.sink = self.tb.power_sink
+        self.running = False
+        self.latency_ms = None  # stream latency behind the sink's markers, see calibrate_latency
+
+    def start(self):
+        if not self.running:
+            self.tb.start()
+            self.running = True
+        return self
+
+    def stop(self):
+        if self.running:
+            self.tb.stop()
+            self.tb.wait()
+            self.running = False
+
+    def measure(self, window_ms=10.0, skip=None, timeout=2.0):
+        # Mean power (dB) over vectors that arrive after the request. The vectors holding
+        # the first `skip` stream samples (default sink.skip, see measure_settled) are
+        # dropped so samples from before the request or the filter transient are not counted.
+        requested_ms = time.time() * 1000.0
+        vector_ms = 1000.0 * self.sink.vlen / self.sink.samp_rate
+        n = max(1, math.ceil(window_ms / vector_ms))
+        dropped = math.ceil((self.sink.skip if skip is None else skip) / self.sink.vlen)
+        with span("measure_power", vectors=n):
+            entries = self.sink.wait_for(dropped + n, requested_ms, timeout)[dropped:]
+        vectors = np.array([vector for _, _, vector in entries])
+        return PowerMeasurement(power=float(vectors.mean()), vectors=vectors, requested_ms=requested_ms,
+                                start_ms=entries[0][1], end_ms=entries[-1][1])
+
+    def measure_settled(self, **kwargs):
+        # See measure_settled(); use right after a beam switch
+        return measure_settled(self.sink, self.sink.samp_rate, **kwargs)
+
+    def calibrate_latency(self, switch, beams, **kwargs):
+        # Measures the stream latency from a beam step (switch(beam) for each of beams) for
+        # the continuous sweeps that follow; see continuous_sweep.measure_latency
+        self.latency_ms = calibrate_latency(self.sink, switch, beams, **kwargs)
+        return self.latency_ms
+
+    def begin_sweep(self, **kwargs):
+        # Continuous sweep over the running stream; see continuous_sweep.py
+        if self.latency_ms is not None:
+            kwargs.setdefault("latency_ms", self.latency_ms)
+        return ContinuousSweep(self.sink, **kwargs)
+
+    def mark(self, label):
+        return self.tb.mark(label)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
 
 if __name__ == '__main__':
     main()
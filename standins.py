@@ -0,0 +1,470 @@
+import asyncio
+import importlib.util
+import io
+import math
+import random
+import sys
+import threading
+import time
+import types
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from continuous_sweep import ContinuousSweep, calibrate_latency
+from powerchain import (PowerMeasurement, block_means, find_settled, make_chain, settle_samples, skip_samples,
+                        synthetic_iq)
+from tracing import span
+
+# Local stand-ins for the survey hardware so the GUI logic can be timed without the robot
+
+# Received level (dB) on each beam, as seen by the fake power sources
+BEAM_POWER_DB = {"0": -48.0, "1": -42.0, "2": -45.0, "3": -39.0, "4": -44.0}
+
+
+class FakeBleakClient:
+    # Mimics the parts of bleak.BleakClient we use, with scan/connect and write delays
+    # in the same range as the Arduino Nano 33 BLE on the survey laptop.
+    connect_delay = 1.2
+    write_delay = 0.015
+    failure_rate = 0.0
+    written = deque(maxlen=1000)  # most recent payloads, across all clients
+    switches = deque(maxlen=1000)  # (time.monotonic(), beam) when each write took effect
+
+    def __init__(self, address, disconnected_callback=None, **kwargs):
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self._connected = False
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.connect_delay)
+        if random.random() < self.failure_rate:
+            raise OSError(f"Device with address {self.address} was not found.")
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        was_connected = self._connected
+        self._connected = False
+        if was_connected and self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+        return True
+
+    async def write_gatt_char(self, char_specifier, data, response=False):
+        if not self._connected:
+            raise OSError("Not connected")
+        await asyncio.sleep(self.write_delay)
+        FakeBleakClient.written.append(bytes(data))
+        # The Arduino switches part-way through the write, before the ack comes back
+        FakeBleakClient.switches.append((time.monotonic() - self.write_delay / 2, bytes(data).decode()))
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+
+class FakeUnicycle:
+    # Simulated TurtleBot base. Stands in for the velocity publisher (publish(Twist)) and
+    # integrates the commands into a pose that is reported at rate_hz, like /odom.
+    # Like the Kobuki base, the last command lapses after command_timeout seconds.
+
+    def __init__(self, on_pose=None, rate_hz=50, command_timeout=0.6, max_accel=(1.0, 3.0),
+                 x=0.0, y=0.0, yaw=0.0, yaw_noise=0.0):
+        self.on_pose = on_pose
+        self.rate_hz = rate_hz
+        self.command_timeout = command_timeout
+        self.max_accel = max_accel  # linear m/s^2, angular rad/s^2
+        self.x, self.y, self.yaw = x, y, yaw
+        self.yaw_noise = yaw_noise
+        self.v = 0.0
+        self.w = 0.0
+        self.cmd = (0.0, 0.0)
+        self.cmd_time = 0.0
+        self.commands = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # rospy.Publisher interface
+    def publish(self, twist):
+        self.cmd = (twist.linear.x, twist.angular.z)
+        self.cmd_time = time.monotonic()
+        self.commands += 1
+
+    def get_num_connections(self):
+        return 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fake-unicycle", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def step(self, dt):
+        v_cmd, w_cmd = self.cmd
+        if time.monotonic() - self.cmd_time > self.command_timeout:
+            v_cmd, w_cmd = 0.0, 0.0
+        dv = max(-self.max_accel[0] * dt, min(self.max_accel[0] * dt, v_cmd - self.v))
+        dw = max(-self.max_accel[1] * dt, min(self.max_accel[1] * dt, w_cmd - self.w))
+        self.v += dv
+        self.w += dw
+        self.x += self.v * math.cos(self.yaw) * dt
+        self.y += self.v * math.sin(self.yaw) * dt
+        self.yaw = (self.yaw + self.w * dt + math.pi) % (2 * math.pi) - math.pi
+        if self.on_pose is not None:
+            measured_yaw = self.yaw + random.gauss(0.0, self.yaw_noise) if self.yaw_noise else self.yaw
+            self.on_pose(self.x, self.y, measured_yaw)
+
+    def _run(self):
+        period = 1.0 / self.rate_hz
+        last = time.monotonic()
+        while not self._stop.is_set():
+            time.sleep(period)
+            now = time.monotonic()
+            self.step(now - last)
+            last = now
+
+
+def install_ros_standins():
+    # Minimal rospy / geometry_msgs / nav_msgs / tf modules, so Move.py imports and drives
+    # a FakeUnicycle on a machine without ROS. Returns whether the stand-ins are in use;
+    # nothing is installed when ROS is.
+    if "rospy" in sys.modules:
+        return getattr(sys.modules["rospy"], "STANDIN", False)
+    if importlib.util.find_spec("rospy") is not None:
+        return False
+
+    class Vector3:
+        def __init__(self):
+            self.x = self.y = self.z = 0.0
+
+    class Twist:
+        def __init__(self):
+            self.linear = Vector3()
+            self.angular = Vector3()
+
+    class Rate:
+        def __init__(self, hz):
+            self.period = 1.0 / hz
+
+        def sleep(self):
+            time.sleep(self.period)
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("ROS is not installed; pass a FakeUnicycle as the publisher")
+
+    def euler_from_quaternion(q):
+        x, y, z, w = q
+        roll = math.atan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+        pitch = math.asin(max(-1.0, min(1.0, 2 * (w * y - z * x))))
+        yaw = math.atan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+        return roll, pitch, yaw
+
+    rospy = types.ModuleType("rospy")
+    rospy.STANDIN = True
+    rospy.is_shutdown = lambda: False
+    rospy.loginfo = lambda msg, *args: print("[ROS] " + (msg % args if args else msg))
+    rospy.Rate = Rate
+    rospy.init_node = rospy.Publisher = rospy.Subscriber = unavailable
+    geometry_msgs = types.ModuleType("geometry_msgs")
+    geometry_msgs.msg = types.ModuleType("geometry_msgs.msg")
+    geometry_msgs.msg.Twist = Twist
+    nav_msgs = types.ModuleType("nav_msgs")
+    nav_msgs.msg = types.ModuleType("nav_msgs.msg")
+    nav_msgs.msg.Odometry = type("Odometry", (), {})
+    tf = types.ModuleType("tf")
+    tf.transformations = types.ModuleType("tf.transformations")
+    tf.transformations.euler_from_quaternion = euler_from_quaternion
+    sys.modules.update({
+        "rospy": rospy,
+        "geometry_msgs": geometry_msgs, "geometry_msgs.msg": geometry_msgs.msg,
+        "nav_msgs": nav_msgs, "nav_msgs.msg": nav_msgs.msg,
+        "tf": tf, "tf.transformations": tf.transformations,
+    })
+    return True
+
+
+def simulated_motion_controller(**kwargs):
+    # MotionController driving a FakeUnicycle instead of the robot; no ROS master needed
+    install_ros_standins()
+    from Move import MotionController
+    sim = FakeUnicycle(**kwargs)
+    controller = MotionController(publisher=sim, subscribe=False)
+    sim.on_pose = controller.update_pose
+    sim.start()
+    return controller, sim
+
+
+class FakeCameraServer:
+    # Local HTTP server with the same /take_photo and /ping routes as take_photo.py,
+    # returning a synthetic JPEG after capture_delay seconds
+    def __init__(self, host="127.0.0.1", port=0, capture_delay=0.4, size=(1280, 960)):
+        self.capture_delay = capture_delay
+        self.jpeg = _synthetic_jpeg(size)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/ping":
+                    body, mimetype = b"pong", "text/plain"
+                elif path == "/take_photo":
+                    time.sleep(server.capture_delay)
+                    body, mimetype = server.jpeg, "image/jpeg"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", mimetype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-camera", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _synthetic_jpeg(size, seed=0):
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size[1] // 16, size[0] // 16, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).resize(size)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def current_beam_level(default=-50.0):
+    # Level of the beam last written to the fake BLE peripheral
+    beam = FakeBleakClient.written[-1].decode() if FakeBleakClient.written else "0"
+    return BEAM_POWER_DB.get(beam, default)
+
+
+def synthetic_iq_source(samp_rate=1000000, tone=2000, noise_db=-70, level_db=current_beam_level, seed=0):
+    # GNU Radio source for signalpow(source=...) in place of the USRP: a tone at
+    # level_db() (re-read every work call) plus noise, phase-continuous across calls
+    from gnuradio import gr
+
+    class SyntheticIQSource(gr.sync_block):
+        def __init__(self):
+            gr.sync_block.__init__(self, name="synthetic_iq_source", in_sig=None, out_sig=[np.complex64])
+            self.rng = np.random.default_rng(seed)
+            self.offset = 0
+
+        def work(self, input_items, output_items):
+            out = output_items[0]
+            n = len(out)
+            t = (self.offset + np.arange(n)) / samp_rate
+            noise = 10 ** (noise_db / 20) / np.sqrt(2)
+            out[:] = 10 ** (level_db() / 20) * np.exp(2j * np.pi * tone * t)
+            out[:] += noise * (self.rng.standard_normal(n) + 1j * self.rng.standard_normal(n))
+            self.offset += n
+            return n
+
+    return SyntheticIQSource()
+
+
+def install_signalpow_standin():
+    # Without GNU Radio, signalpow cannot be imported; register a module whose
+    # PowerService is FakePowerService so code importing it still loads. Returns whether
+    # the stand-in is in use; nothing is installed when GNU Radio is.
+    if "signalpow" in sys.modules:
+        return getattr(sys.modules["signalpow"], "STANDIN", False)
+    if importlib.util.find_spec("gnuradio") is not None:
+        return False
+    module = types.ModuleType("signalpow")
+    module.STANDIN = True
+    module.PowerService = FakePowerService
+    sys.modules["signalpow"] = module
+    return True
+
+
+class FakePowerStream:
+    # Power stream for ContinuousSweep, generated on demand: synthetic IQ whose level
+    # follows the beam switches made through FakeBleakClient, through the NumPy chain.
+    # sample_index() lags real time by latency_ms, like the flowgraph's ring buffer.
+    # samp_rate and vlen are the power stream's; iq_rate is the radio's.
+
+    def __init__(self, samp_rate=1000000, latency_ms=3.0, rng=None, decimating=False):
+        self.iq_rate = samp_rate
+        self.latency = latency_ms / 1000.0
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.chain = make_chain(decimating, samp_rate=samp_rate, chunk_size=1 << 15)
+        self.samp_rate = self.chain.out_rate
+        self.vlen = self.chain.vlen
+        self.levels = {}  # switch -> level, each with its own random offset
+        self.initial = current_beam_level() + self.rng.normal(0.0, 2.0)
+        # Started one latency ago, as if the flowgraph was already running, so sample 0
+        # arrives now
+        self.t0 = time.monotonic() - self.latency
+        self.power = np.zeros(0, dtype=np.float32)
+        self.position = 0  # IQ samples generated from t0
+        # Settle the filter and moving average on the starting beam
+        warmup = self.iq_per_vector * math.ceil(settle_samples(self.chain) / self.iq_per_vector)
+        self.chain.process_chunk(synthetic_iq(warmup, samp_rate, power_db=self.initial, start=-warmup))
+
+    @property
+    def iq_per_vector(self):
+        return self.chain.vlen * self.chain.decimation
+
+    def sample_index(self):
+        return int((time.monotonic() - self.t0 - self.latency) * self.samp_rate)
+
+    def _levels(self, start, n):
+        # Level (dB) of each of the n samples from index start
+        levels = np.full(n, self.initial)
+        for switch in list(FakeBleakClient.switches):
+            index = int((switch[0] - self.t0) * self.iq_rate)
+            if index >= start + n:
+                continue
+            if switch not in self.levels:
+                self.levels[switch] = BEAM_POWER_DB.get(switch[1], -50.0) + self.rng.normal(0.0, 2.0)
+            levels[max(0, index - start):] = self.levels[switch]
+        return levels
+
+    def read(self, start, stop, timeout):
+        wait = (stop - self.sample_index()) / self.samp_rate
+        if wait > timeout:
+            raise TimeoutError(f"Power samples up to {stop} did not arrive within {timeout} s")
+        time.sleep(max(0.0, wait))
+        while len(self.power) < stop:
+            n = math.ceil((stop - len(self.power)) / self.chain.vlen) * self.iq_per_vector
+            # Tone and noise at a fixed SNR, scaled to each sample's level
+            iq = synthetic_iq(n, self.iq_rate, power_db=0.0, noise_db=-30.0,
+                              seed=int(self.rng.integers(1 << 31)), start=self.position)
+            iq *= (10 ** (self._levels(self.position, n) / 20)).astype(np.float32)
+            self.position += n
+            self.power = np.concatenate((self.power, self.chain.process_chunk(iq).ravel()))
+        return self.power[max(0, start):stop]
+
+
+class FakePowerService:
+    # Stands in for signalpow.PowerService: runs the NumPy power chain over synthetic IQ
+    # whose level depends on the beam last written to the fake BLE peripheral
+
+    def __init__(self, samp_rate=1000000, seed=0, decimating=False, stream_latency_ms=3.0):
+        self.samp_rate = samp_rate
+        self.decimating = decimating
+        self.stream_latency_ms = stream_latency_ms  # radio-to-sink latency of the fake stream
+        self.latency_ms = None
+        self.rng = np.random.default_rng(seed)
+        self.markers = []
+        self.level = None  # level of the previous measurement, i.e. the beam before a switch
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def mark(self, label):
+        self.markers.append((time.time(), str(label)))
+
+    def measure(self, window_ms=10.0, skip=None, timeout=2.0):
+        with span("measure_power"):
+            return self._measure(window_ms, skip)
+
+    def _measure(self, window_ms, skip):
+        requested_ms = time.time() * 1000.0
+        level = current_beam_level() + self.rng.normal(0.0, 2.0)
+        chain = self._chain()
+        n_vectors = max(1, math.ceil(window_ms * chain.out_rate / 1000.0 / chain.vlen))
+        dropped = math.ceil((skip_samples(chain) if skip is None else skip) / chain.vlen)
+        # The real service waits for the dropped and the measured vectors to arrive
+        time.sleep((dropped + n_vectors) * chain.vlen / chain.out_rate)
+
+        # Extra leading samples let the filter and moving average settle, as in the stream
+        iq_per_vector = chain.vlen * chain.decimation
+        settle = settle_samples(chain) + iq_per_vector
+        iq = synthetic_iq(settle + n_vectors * iq_per_vector, self.samp_rate, power_db=level,
+                          seed=int(self.rng.integers(1 << 31)))
+        vectors = chain.process(iq)[-n_vectors:]
+        self.level = level
+        end_ms = time.time() * 1000.0
+        return PowerMeasurement(power=float(vectors.mean()), vectors=vectors, requested_ms=requested_ms,
+                                start_ms=end_ms - 1000.0 * n_vectors * chain.vlen / chain.out_rate, end_ms=end_ms)
+
+    def _chain(self):
+        return make_chain(self.decimating, samp_rate=self.samp_rate, chunk_size=1 << 15)
+
+    def _stream(self):
+        return FakePowerStream(self.samp_rate, self.stream_latency_ms, rng=self.rng, decimating=self.decimating)
+
+    def calibrate_latency(self, switch, beams, **kwargs):
+        self.latency_ms = calibrate_latency(self._stream(), switch, beams, **kwargs)
+        return self.latency_ms
+
+    def begin_sweep(self, **kwargs):
+        if self.latency_ms is not None:
+            kwargs.setdefault("latency_ms", self.latency_ms)
+        return ContinuousSweep(self._stream(), **kwargs)
+
+    def measure_settled(self, window=4, ci_db=0.25, confidence=0.95, skip=None, timeout=0.5, block=None):
+        # Same test as signalpow.measure_settled, on a stream that holds the previous
+        # beam's level for part of the first vector before switching to the new one
+        with span("measure_settled") as s:
+            requested_ms = time.time() * 1000.0
+            level = current_beam_level() + self.rng.normal(0.0, 2.0)
+            previous = level if self.level is None else self.level
+            self.level = level
+            chain = self._chain()
+            block = block or chain.vlen // 4
+            skip = skip_samples(chain) if skip is None else skip
+            iq_per_vector = chain.vlen * chain.decimation
+            offset = 0
+
+            def segment(n, power_db):
+                nonlocal offset
+                iq = synthetic_iq(n, self.samp_rate, power_db=power_db, seed=int(self.rng.integers(1 << 31)),
+                                  start=offset)
+                offset += n
+                return iq
+
+            # Settled on the previous beam, then the switch part-way into the first vector
+            warmup = math.ceil(settle_samples(chain) / iq_per_vector) * iq_per_vector
+            chain.process_chunk(segment(warmup, previous))
+            switch = int(self.rng.integers(0, iq_per_vector // 2))
+            vectors = [chain.process_chunk(np.concatenate((segment(switch, previous),
+                                                           segment(iq_per_vector - switch, level))))]
+            max_vectors = max(1, int(timeout * chain.out_rate / chain.vlen))
+            n = max(1, math.ceil((skip + window * block) / chain.vlen))
+            while True:
+                if len(vectors) >= n:
+                    stream = np.concatenate(vectors).ravel()[skip:]
+                    result = find_settled(block_means(stream, block), window, ci_db, confidence)
+                    if result.settled or len(vectors) >= max_vectors:
+                        break
+                vectors.append(chain.process_chunk(segment(iq_per_vector, level)))
+            vectors = np.concatenate(vectors)
+            # The real service waits for the stream to deliver these vectors
+            time.sleep(len(vectors) * chain.vlen / chain.out_rate)
+            settle_ms = 1000.0 * (skip + result.start * block) / chain.out_rate
+            s.set(vectors=len(vectors), settle_ms=settle_ms, ci_db=result.ci_db, settled=result.settled)
+        end_ms = time.time() * 1000.0
+        return PowerMeasurement(power=result.power, vectors=vectors, requested_ms=requested_ms,
+                                start_ms=requested_ms + settle_ms, end_ms=end_ms,
+                                settle_ms=settle_ms, ci_db=result.ci_db, settled=result.settled)
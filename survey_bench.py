@@ -0,0 +1,265 @@
+import argparse
+import functools
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from image_pipeline import PreviewPipeline
+from standins import (FakeBleakClient, FakePowerService, install_ros_standins, install_signalpow_standin,
+                      simulated_motion_controller, synthetic_iq_source)
+from tracing import latency_stats, tracer
+
+# End-to-end survey benchmark: runs SnapdragonCameraApp.run_survey (the logic behind the
+# "Capture Data" button) headlessly against stand-ins for every piece of hardware:
+#   robot      FakeUnicycle integrating the velocity commands and publishing odometry
+#   Arduino    FakeBleakClient behind the real BleSession
+#   USRP       synthetic IQ through the signalpow flowgraph (NumPy chain without GNU Radio)
+#   phone      take_photo.py's Flask app with the fake camera, served locally
+# and writes per-stage latency distributions and samples/min to JSON. Comparing two
+# result files flags regressions between versions.
+
+
+class InlineDispatcher:
+    # TkDispatcher stand-in: UI calls run straight away on the calling thread
+
+    def call(self, fn, *args, **kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            print(f"[ERROR] UI update failed: {e}")
+
+
+class StatusVar:
+    # tk.StringVar stand-in
+    def __init__(self):
+        self.value = ""
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class HeadlessPreviews(PreviewPipeline):
+    # Previews are still decoded (that cost is part of the survey); only the Tk display is skipped
+    def _display(self, seq, img, label_widget):
+        pass
+
+
+class CallTimer:
+    # Wraps the functions a survey stage calls and records how long each call takes
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.durations[name].append(time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        with self._lock:
+            return {name: latency_stats(values) for name, values in sorted(self.durations.items())}
+
+
+def start_camera_server(capture_delay=0.3):
+    import take_photo
+    from werkzeug.serving import make_server
+
+    take_photo.camera = take_photo.CameraWorker(capture_fn=functools.partial(take_photo.fake_capture, delay=capture_delay),
+                                                output_dir=tempfile.mkdtemp(prefix="fake_camera_"))
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, take_photo.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="fake-camera", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def run_benchmark(rows=1, samples_per_row=10, capture_delay=0.3, ble_write_delay=None, guided_model=None,
+                  save_dir=None, trace_path=None, continuous=False, decimating=False, stream_latency_ms=3.0):
+    # trace_path: also record tracing spans and write them there as a Chrome trace.
+    # continuous: sweep each sample from one stream (CONTINUOUS_SWEEP)
+    # decimating: power from the decimating chain (DECIMATE_POWER)
+    # stream_latency_ms: radio-to-sink latency of the stand-in power stream
+    ros = "standin" if install_ros_standins() else "rospy"
+    power_backend = "numpy" if install_signalpow_standin() else "flowgraph"
+    import Move
+    import Turtlebot_GUI_BLE as gui
+    from ble_session import BleSession
+    from photo_client import PhotoClient
+    from shards import ShardWriter
+
+    class HeadlessApp(gui.SnapdragonCameraApp):
+        # Everything run_survey touches, without a Tk root or widgets
+        def __init__(self, ble, power, dataset, guide=None):
+            self.root = None
+            self.auto_capturing = False
+            self.ui = InlineDispatcher()
+            self.previews = HeadlessPreviews(self.ui, size=gui.PREVIEW_SIZE)
+            self.ble = ble
+            self.power = power
+            self.dataset = dataset
+            self.guide = guide
+            self.image_label = None
+            self.status_var = StatusVar()
+
+        def export_trace(self):
+            pass  # run_benchmark writes the trace to trace_path instead of SAVE_DIR
+
+    if ble_write_delay is not None:
+        FakeBleakClient.write_delay = ble_write_delay
+    save_dir = Path(save_dir or tempfile.mkdtemp(prefix="survey_bench_"))
+    server, camera_url = start_camera_server(capture_delay)
+    controller, sim = simulated_motion_controller()
+    Move._controller = controller  # get_controller() now returns the simulated base
+    ble = BleSession(gui.ARDUINO_ADDR, gui.CHAR_UUID, client_factory=FakeBleakClient)
+    if power_backend == "flowgraph":
+        from signalpow import PowerService
+        power = PowerService(source=synthetic_iq_source(), decimating=decimating).start()
+    else:
+        power = FakePowerService(decimating=decimating, stream_latency_ms=stream_latency_ms)
+    dataset = ShardWriter(save_dir / "shards", gui.BEAMS, max_records=gui.SHARD_RECORDS)
+    photos = PhotoClient(camera_url)
+    guide = None
+    if guided_model:
+        from guided_sweep import GuidedSweep
+        from inference import BeamPredictor
+        guide = GuidedSweep(BeamPredictor(guided_model, num_threads=2), gui.BEAMS, top_k=gui.GUIDE_TOP_K,
+                            min_confidence=gui.GUIDE_MIN_CONFIDENCE, audit_every=gui.GUIDE_AUDIT_EVERY)
+    app = HeadlessApp(ble, power, dataset, guide)
+
+    # Time the calls inside each stage. run_survey looks these up as module globals.
+    timer = CallTimer()
+    patched = ("move_distance", "correct_yaw", "move_next_row", "photo_client", "CONTINUOUS_SWEEP")
+    originals = {name: getattr(gui, name) for name in patched}
+    for name in patched[:3]:
+        setattr(gui, name, timer.wrap(name, originals[name]))
+    photos.take_photo = timer.wrap("take_photo", photos.take_photo)
+    photos.fetch_frame = timer.wrap("fetch_frame", photos.fetch_frame)
+    gui.photo_client = photos
+    gui.CONTINUOUS_SWEEP = continuous
+    app.sweep_beams = timer.wrap("sweep_beams", app.sweep_beams)
+    app.switch_beam = timer.wrap("switch_beam", app.switch_beam)
+    power.measure = timer.wrap("measure_power", power.measure)
+    power.measure_settled = timer.wrap("measure_settled", power.measure_settled)
+    dataset.append = timer.wrap("dataset_append", dataset.append)
+    if guide is not None:
+        guide.plan = timer.wrap("guide_plan", guide.plan)
+
+    print(f"[INFO] Benchmarking {rows} x {samples_per_row} samples (power: {power_backend}, ROS: {ros})")
+    if trace_path is not None:
+        tracer.clear()
+        tracer.enable()
+    try:
+        summary = app.run_survey(rows, samples_per_row)
+    finally:
+        if trace_path is not None:
+            tracer.disable()
+            tracer.export_chrome(trace_path)
+        for name, value in originals.items():
+            setattr(gui, name, value)
+        Move._controller = None
+        app.previews.shutdown()
+        dataset.close()
+        photos.close()
+        ble.close()
+        power.stop()
+        sim.stop()
+        server.shutdown()
+    if summary is None:
+        raise RuntimeError("Survey failed, see the log above")
+
+    calls = timer.summary()
+    for name, stats in calls.items():
+        print(f"[INFO]   {name:<15} mean {stats['mean_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  "
+              f"(n={stats['count']})")
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "config": {
+            "rows": rows, "samples_per_row": samples_per_row, "capture_delay_s": capture_delay,
+            "ble_write_delay_s": FakeBleakClient.write_delay, "guided_model": guided_model,
+            "power": power_backend, "ros": ros, "continuous_sweep": continuous,
+            "decimating": decimating, "stream_latency_ms": stream_latency_ms,
+        },
+        "samples_per_min": summary["samples_per_min"],
+        "pipeline": summary,
+        "calls": calls,
+        "ble": ble.latency_summary(),
+    }
+
+
+def compare(baseline, current, tolerance=0.2, floor_ms=1.0):
+    # Regressions of current against baseline: samples/min down, or a stage's or call's
+    # median up, by more than tolerance. Medians under floor_ms are too noisy to compare.
+    regressions = []
+    old_rate, new_rate = baseline["samples_per_min"], current["samples_per_min"]
+    if new_rate < old_rate * (1 - tolerance):
+        regressions.append(f"samples/min {old_rate:.1f} -> {new_rate:.1f}")
+    for section in ("pipeline", "calls"):
+        old_stats = baseline[section]["stages"] if section == "pipeline" else baseline[section]
+        new_stats = current[section]["stages"] if section == "pipeline" else current[section]
+        for name, stats in new_stats.items():
+            old = old_stats.get(name)
+            if not old or not old.get("count") or not stats.get("count"):
+                continue
+            if old["p50_ms"] >= floor_ms and stats["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+                regressions.append(f"{name} p50 {old['p50_ms']:.1f} ms -> {stats['p50_ms']:.1f} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the survey loop against hardware stand-ins")
+    parser.add_argument("--rows", type=int, default=1)
+    parser.add_argument("--samples-per-row", type=int, default=10)
+    parser.add_argument("--capture-delay", type=float, default=0.3, help="fake camera capture time (s)")
+    parser.add_argument("--ble-delay", type=float, default=None, help="fake BLE write time (s)")
+    parser.add_argument("--guided", metavar="MODEL", help="exported beam predictor for a guided sweep")
+    parser.add_argument("--out", default="survey_bench.json")
+    parser.add_argument("--trace", help="also write a Chrome/Perfetto trace of the run here")
+    parser.add_argument("--continuous", action="store_true", help="continuous-stream beam sweeps")
+    parser.add_argument("--decimate", action="store_true", help="power from the decimating chain")
+    parser.add_argument("--stream-latency", type=float, default=3.0, help="stand-in power stream latency (ms)")
+    parser.add_argument("--baseline", help="earlier result file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = run_benchmark(args.rows, args.samples_per_row, args.capture_delay, args.ble_delay, args.guided,
+                           trace_path=args.trace, continuous=args.continuous,
+                           decimating=args.decimate, stream_latency_ms=args.stream_latency)
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=1)
+    print(f"[INFO] {result['samples_per_min']:.1f} samples/min, results written to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), result, args.tolerance)
+        for regression in regressions:
+            print(f"[WARN] Regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"[INFO] No regressions against {args.baseline}")
@@ -1,33 +1,310 @@
-from flask import Flask, send_file
+from flask import Flask, Response, abort, request, send_file
+from collections import deque, namedtuple
+from contextlib import contextmanager
+import argparse
+import io
 import os
+import subprocess
+import threading
 import time
 
 app = Flask(__name__)
 
+PICTURES_DIR = "/storage/emulated/0/Pictures"  # This is the same as ~/storage/shared/Pictures
+JPEG_EOI = b"\xff\xd9"
+MAX_BURST = 20
+RECENT_FRAMES = 8  # kept so a client can fetch a full-size copy of a frame it previewed
+MAX_SIDE = 8192  # largest width/height a client may ask for
+
+Frame = namedtuple("Frame", ["id", "data", "started", "finished"])
+
+
+def termux_capture(path):
+    # Take photo using termux-camera-photo
+    return subprocess.run(["termux-camera-photo", path]).returncode
+
+
+def fake_capture(path, delay=0.3):
+    # Stand-in for termux-camera-photo: returns straight away and finishes writing the
+    # JPEG in the background, the same way the real command does
+    data = _fake_jpeg()
+
+    def write():
+        time.sleep(delay / 2)
+        with open(path, "wb") as f:
+            f.write(data[:len(data) // 2])
+            f.flush()
+            time.sleep(delay / 2)
+            f.write(data[len(data) // 2:])
+
+    threading.Thread(target=write, daemon=True).start()
+    return 0
+
+
+_fake_jpeg_cache = []
+
+def _fake_jpeg(size=(1280, 960)):
+    if not _fake_jpeg_cache:
+        from PIL import Image
+        image = Image.linear_gradient("L").resize(size).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        _fake_jpeg_cache.append(buffer.getvalue())
+    return _fake_jpeg_cache[0]
+
+
+def wait_until_finalised(path, timeout=5.0, poll=0.01):
+    # The JPEG is complete once it ends with the EOI marker and its size has stopped changing
+    deadline = time.monotonic() + timeout
+    last_size = -1
+    while time.monotonic() < deadline:
+        try:
+            size = os.path.getsize(path)
+            if size > 2 and size == last_size:
+                with open(path, "rb") as f:
+                    f.seek(-2, os.SEEK_END)
+                    if f.read(2) == JPEG_EOI:
+                        return size
+            last_size = size
+        except OSError:
+            pass
+        time.sleep(poll)
+    raise TimeoutError(f"{path} was not finalised within {timeout} s")
+
+
+class CameraWorker:
+    # Single capture thread that owns the camera. Requests wait for the next frame whose
+    # capture started after they arrived, so concurrent requests share one capture
+    # instead of racing on the same file, and the bytes are served from memory.
+
+    def __init__(self, capture_fn=termux_capture, output_dir=PICTURES_DIR, finalise_timeout=5.0):
+        self.capture_fn = capture_fn
+        self.output_dir = output_dir
+        self.finalise_timeout = finalise_timeout
+        self.cond = threading.Condition()
+        self.frame = None
+        self.recent = deque(maxlen=RECENT_FRAMES)
+        self.failure = None  # (started, message) of the last failed capture
+        self.pending = []    # request times of callers waiting for a fresh frame
+        self.last_started = 0.0
+        self.streams = 0
+        self._thread = None
+
+    def start(self):
+        with self.cond:
+            if self._thread is None:
+                os.makedirs(self.output_dir, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="camera", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        count = 0
+        while True:
+            with self.cond:
+                # Capture only while a stream is open or a caller needs a frame newer than
+                # the last capture started
+                while self.streams == 0 and not any(after > self.last_started for after in self.pending):
+                    self.cond.wait()
+                started = time.time()
+                self.last_started = started
+            # Alternate files so a reader never sees the next capture overwrite this one
+            path = os.path.join(self.output_dir, f"photo_{count % 2}.jpg")
+            count += 1
+            try:
+                data = self._capture_once(path)
+            except Exception as e:
+                with self.cond:
+                    self.failure = (started, str(e))
+                    self.cond.notify_all()
+                time.sleep(0.1)
+                continue
+            with self.cond:
+                frame_id = self.frame.id + 1 if self.frame else 1
+                self.frame = Frame(frame_id, data, started, time.time())
+                self.recent.append(self.frame)
+                self.cond.notify_all()
+
+    def _capture_once(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        ret = self.capture_fn(path)
+        if ret != 0:
+            raise RuntimeError(f"Camera command exited with {ret}")
+        wait_until_finalised(path, self.finalise_timeout)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def next_frame(self, after=None, timeout=10.0):
+        after = time.time() if after is None else after
+        self.start()
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.pending.append(after)
+            self.cond.notify_all()
+            try:
+                while self.frame is None or self.frame.started < after:
+                    if self.failure is not None and self.failure[0] >= after:
+                        raise RuntimeError(self.failure[1])
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("No frame captured in time")
+                    self.cond.wait(remaining)
+                return self.frame
+            finally:
+                self.pending.remove(after)
+
+    def latest(self):
+        with self.cond:
+            return self.frame
+
+    def get(self, frame_id):
+        with self.cond:
+            for frame in self.recent:
+                if frame.id == frame_id:
+                    return frame
+        return None
+
+    @contextmanager
+    def streaming(self):
+        # Keeps the worker capturing back-to-back while a stream client is connected
+        self.start()
+        with self.cond:
+            self.streams += 1
+            self.cond.notify_all()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.streams -= 1
+
+
+camera = CameraWorker()
+
+
+def resize_jpeg(data, width=None, height=None, quality=None):
+    # Smaller copy for previews; without width/height/quality the original bytes are kept
+    if width is None and height is None and quality is None:
+        return data
+    from PIL import Image
+    img = Image.open(io.BytesIO(data))
+    if width is not None or height is not None:
+        if width is None:
+            width = round(img.width * height / img.height)
+        elif height is None:
+            height = round(img.height * width / img.width)
+        img.draft("RGB", (width, height))  # let the JPEG decoder downscale by 1/2, 1/4 or 1/8
+        img = img.convert("RGB").resize((width, height))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality or 85)
+    return buffer.getvalue()
+
+
+def _int_arg(name, limit, default=None):
+    # Integer query parameter from 1 to limit; anything else aborts the request with 400
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        abort(Response(f"{name} must be an integer, got {value!r}", 400))
+    if not 1 <= number <= limit:
+        abort(Response(f"{name} must be between 1 and {limit}, got {number}", 400))
+    return number
+
+
+def _resize_args():
+    # width/height/quality query parameters for resize_jpeg
+    limits = {"width": MAX_SIDE, "height": MAX_SIDE, "quality": 100}
+    args = {name: _int_arg(name, limit) for name, limit in limits.items()}
+    return {name: value for name, value in args.items() if value is not None}
+
+
+def _jpeg_response(frame, resize):
+    data = resize_jpeg(frame.data, **resize)
+    response = send_file(io.BytesIO(data), mimetype="image/jpeg")
+    response.headers["X-Frame-Id"] = str(frame.id)
+    response.headers["X-Capture-Time"] = f"{frame.finished - frame.started:.3f}"
+    return response
+
+
 @app.route("/take_photo")
 def take_photo():
-    output_path = "/storage/emulated/0/Pictures/photo.jpg"  # This is the same as ~/storage/shared/Pictures/photo.jpg
+    # The first frame whose capture starts after this request. Requests that arrive while
+    # a capture is still pending share it (same X-Frame-Id) instead of each triggering
+    # their own, so concurrent callers that need distinct photos should use /burst.
+    resize = _resize_args()  # before capturing, so a bad request costs no photo
+    try:
+        frame = camera.next_frame()
+    except Exception as e:
+        return f"Photo capture failed: {e}", 500
+    return _jpeg_response(frame, resize)
 
-    # Make sure folder exists
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+@app.route("/latest")
+def latest():
+    # Most recent frame without waiting for a new capture
+    resize = _resize_args()
+    frame = camera.latest()
+    if frame is None:
+        return "No photo captured yet", 404
+    return _jpeg_response(frame, resize)
 
-    # Take photo using termux-camera-photo
-    ret = os.system(f"termux-camera-photo {output_path}")
-    if ret != 0:
-        return "Failed to run camera command", 500
+@app.route("/frame/<int:frame_id>")
+def get_frame(frame_id):
+    resize = _resize_args()
+    frame = camera.get(frame_id)
+    if frame is None:
+        return f"Frame {frame_id} is no longer buffered", 404
+    return _jpeg_response(frame, resize)
 
-    # Wait a bit for photo to save
-    time.sleep(1)
+@app.route("/burst")
+def burst():
+    n = _int_arg("n", MAX_BURST, default=3)
+    frames = []
+    after = time.time()
+    try:
+        for _ in range(n):
+            frame = camera.next_frame(after)
+            frames.append(frame)
+            after = frame.started + 1e-6
+    except Exception as e:
+        return f"Burst capture failed: {e}", 500
 
-    if os.path.exists(output_path):
-        return send_file(output_path, mimetype="image/jpeg")
-    else:
-        return "Photo capture failed", 500
+    boundary = "frame"
+    body = io.BytesIO()
+    for frame in frames:
+        body.write(f"--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame.data)}\r\n"
+                   f"X-Frame-Id: {frame.id}\r\n\r\n".encode())
+        body.write(frame.data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return Response(body.getvalue(), mimetype=f"multipart/mixed; boundary={boundary}")
+
+@app.route("/stream")
+def stream():
+    # MJPEG: every new frame replaces the previous one in the client
+    def frames():
+        with camera.streaming():
+            after = time.time()
+            while True:
+                frame = camera.next_frame(after)
+                after = frame.started + 1e-6
+                yield (b"--frame\r\nContent-Type: image/jpeg\r\n"
+                       b"Content-Length: " + str(len(frame.data)).encode() + b"\r\n\r\n" + frame.data + b"\r\n")
+    return Response(frames(), mimetype="multipart/x-mixed-replace; boundary=frame")
 
 @app.route("/ping")
 def ping():
     return "pong"
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fake", action="store_true", help="Serve synthetic frames instead of the phone camera")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    if args.fake:
+        camera = CameraWorker(capture_fn=fake_capture, output_dir=os.path.join(os.path.expanduser("~"), "fake_camera"))
+
     # Listen on all interfaces so your PC can connect
-    app.run(host="0.0.0.0", port=8000, debug=True, use_reloader=False)
+    app.run(host="0.0.0.0", port=args.port, debug=True, use_reloader=False, threaded=True)
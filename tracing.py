@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+# Lightweight timing spans and events for the capture loop. Tracing is off by default;
+# then span() hands back one shared no-op object, so instrumented code pays for an
+# attribute check and a method call. When enabled, every span is kept for export as a
+# Chrome trace (open in chrome://tracing or ui.perfetto.dev) and the last `window`
+# durations per span name feed a rolling summary.
+#
+#   from tracing import span, event, tracer
+#   tracer.enable()
+#   with span("measure_power", beam=beam) as s:
+#       ...
+#       s.set(vectors=len(vectors))
+#   event("ble_retry", beam=beam, attempt=2)
+#   tracer.export_chrome("trace.json")
+
+
+def latency_stats(seconds):
+    ms = np.array(seconds) * 1000.0
+    if len(ms) == 0:
+        return {"count": 0}
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "max_ms": float(ms.max()),
+    }
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def set(self, **args):
+        # Attach results (errors, attempt counts, ...) once they are known
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer._record("X", self.name, self.start, end - self.start, self.args)
+        return False
+
+
+class Tracer:
+
+    def __init__(self, window=50, max_events=200000):
+        self.enabled = False
+        self.window = window
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self.clear()
+
+    def enable(self):
+        self.enabled = True
+        return self
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self.events = deque(maxlen=self.max_events)  # oldest dropped on long surveys
+            self.recent = {}
+            self.counts = defaultdict(int)
+            self.threads = {}
+            self.origin_ns = time.perf_counter_ns()
+            self.origin_time = time.time()
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def event(self, name, **args):
+        # Instant event, e.g. a retry; counted by name in summary()
+        if self.enabled:
+            self._record("i", name, time.perf_counter_ns(), 0, args)
+
+    def _record(self, phase, name, start, duration, args):
+        tid = threading.get_ident()
+        with self._lock:
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+            self.events.append((phase, name, start, duration, tid, args))
+            if phase == "X":
+                recent = self.recent.get(name)
+                if recent is None:
+                    recent = self.recent[name] = deque(maxlen=self.window)
+                recent.append(duration / 1e9)
+            else:
+                self.counts[name] += 1
+
+    def summary(self):
+        # Latency stats over the last `window` spans of each name, and event counts
+        with self._lock:
+            recent = {name: list(values) for name, values in self.recent.items()}
+            counts = dict(self.counts)
+        return {"spans": {name: latency_stats(values) for name, values in sorted(recent.items())},
+                "events": counts}
+
+    def bottleneck(self, names=None):
+        # Span name (of `names`, or any) with the highest recent mean duration, and that mean in s
+        with self._lock:
+            means = {name: sum(values) / len(values) for name, values in self.recent.items()
+                     if values and (names is None or name in names)}
+        if not means:
+            return None
+        name = max(means, key=means.get)
+        return name, means[name]
+
+    def print_summary(self):
+        summary = self.summary()
+        for name, stats in summary["spans"].items():
+            print(f"[INFO]   {name:<18} mean {stats['mean_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  "
+                  f"(last {stats['count']})")
+        for name, count in sorted(summary["events"].items()):
+            print(f"[INFO]   {name:<18} {count} events")
+
+    def export_chrome(self, path):
+        # Chrome trace event format; timestamps in microseconds from when tracing was cleared
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        trace = [{"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": "survey"}}]
+        for tid, thread_name in threads.items():
+            trace.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+        for phase, name, start, duration, tid, args in events:
+            entry = {"name": name, "ph": phase, "ts": (start - self.origin_ns) / 1000.0, "pid": pid, "tid": tid}
+            if phase == "X":
+                entry["dur"] = duration / 1000.0
+            else:
+                entry["s"] = "t"
+            if args:
+                entry["args"] = args
+            trace.append(entry)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms",
+                       "otherData": {"start_time": self.origin_time}}, f, default=_json_value)
+        os.replace(tmp, path)
+        print(f"[INFO] Wrote {len(events)} trace events to {path}")
+        return path
+
+
+def _json_value(value):
+    # numpy scalars and anything else json cannot encode
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+# Process-wide tracer used by the instrumented modules
+tracer = Tracer()
+span = tracer.span
+event = tracer.event